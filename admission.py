@@ -0,0 +1,206 @@
+"""
+Admission control for model calls.
+
+Every chat completion passes through an LLMScheduler before it is sent. The scheduler
+enforces requests-per-minute and tokens-per-minute budgets with token buckets, serves
+waiting calls round-robin across sessions so one heavy user can't starve the others,
+lets opener calls jump the queue, and sheds load once the queue gets too deep.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from config import (
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_QUEUE_DEPTH, LLM_QUEUE_NOTIFY_DEPTH
+)
+
+
+class SchedulerBusy(Exception):
+    """Raised when the queue is too deep to accept another call."""
+
+    def __init__(self, position):
+        super().__init__(f"LLM queue is full ({position} calls waiting)")
+        self.position = position
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens per second. It holds a
+    minute's worth of tokens unless a smaller `capacity` limits the burst size.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, per_minute, capacity=None):
+        self.capacity = per_minute if capacity is None else capacity
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, amount):
+        # May go negative when a call turns out bigger than estimated; that debt is
+        # paid back by refills before anything else is admitted.
+        self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ("owner", "tokens", "future", "enqueued")
+
+    def __init__(self, owner, tokens):
+        self.owner = owner
+        self.tokens = tokens
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Admits model calls within RPM/TPM budgets, fairly across owners.
+
+    An owner is any hashable identifying whose call it is (one per session). Priority
+    calls are admitted before everything else; the rest are served one call per owner
+    in turn. A budget of 0 disables that limit.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_queue_depth=LLM_MAX_QUEUE_DEPTH, notify_depth=LLM_QUEUE_NOTIFY_DEPTH):
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_queue_depth = max_queue_depth
+        self.notify_depth = notify_depth
+        self._priority = deque()
+        self._queues = OrderedDict()
+        self._depth = 0
+        self._dispatcher = None
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self):
+        """Number of calls currently waiting for admission."""
+        return self._depth
+
+    def _delay(self, tokens):
+        now = time.monotonic()
+        delay = 0.0
+        if self._requests is not None:
+            delay = self._requests.delay(1, now)
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.delay(tokens, now))
+        return delay
+
+    def _consume(self, tokens):
+        if self._requests is not None:
+            self._requests.consume(1)
+        if self._tokens is not None:
+            self._tokens.consume(tokens)
+        self.admitted += 1
+
+    def _record_wait(self, waited):
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    async def acquire(self, owner, tokens, priority=False, on_queued=None):
+        """
+        Waits until a call of roughly `tokens` tokens may be sent for `owner`.
+
+        If the call has to queue behind at least `notify_depth` others, `on_queued` is
+        awaited with the call's queue position. Raises SchedulerBusy if `max_queue_depth`
+        calls are already waiting.
+        """
+        if self._depth == 0 and self._delay(tokens) == 0:
+            self._consume(tokens)
+            self._record_wait(0.0)
+            return
+
+        if self._depth >= self.max_queue_depth:
+            self.rejected += 1
+            raise SchedulerBusy(self._depth + 1)
+
+        waiter = _Waiter(owner, tokens)
+        queue = self._priority if priority else self._queues.setdefault(owner, deque())
+        queue.append(waiter)
+        self._depth += 1
+        position = len(self._priority) if priority else self._depth
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            if on_queued is not None and position > self.notify_depth:
+                await on_queued(position)
+            await waiter.future
+        except BaseException:
+            # Cancelled (or on_queued failed) while still queued: give up the place
+            waiter.future.cancel()
+            self._remove(waiter, queue)
+            raise
+
+    def _remove(self, waiter, queue):
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        self._depth -= 1
+        if queue is not self._priority and not queue:
+            self._queues.pop(waiter.owner, None)
+
+    def _next_waiter(self):
+        """Returns the waiter to admit next without dequeuing it."""
+        if self._priority:
+            return self._priority[0]
+        if self._queues:
+            return next(iter(self._queues.values()))[0]
+        return None
+
+    def _pop_waiter(self, waiter):
+        if self._priority and self._priority[0] is waiter:
+            self._priority.popleft()
+        else:
+            queue = self._queues.pop(waiter.owner)
+            queue.popleft()
+            if queue:
+                # Move the owner to the back of the rotation
+                self._queues[waiter.owner] = queue
+        self._depth -= 1
+
+    async def _dispatch(self):
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            delay = self._delay(waiter.tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._pop_waiter(waiter)
+            if waiter.future.done():
+                continue
+            self._consume(waiter.tokens)
+            self._record_wait(time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Corrects the token budget once a call's real token usage is known."""
+        if self._tokens is not None and actual_tokens is not None:
+            self._tokens.consume(actual_tokens - estimated_tokens)
+
+    def stats(self):
+        """Returns queue depth, admission counters and wait times."""
+        return {
+            "queue_depth": self._depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "mean_wait_seconds": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
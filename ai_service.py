@@ -1,31 +1,382 @@
-from openai import OpenAI
-from config import GEMINI_MODEL, USER_DATA_HISTORY
-from persona_data import PERSONAS
+import asyncio
+import logging
+import threading
+import time
+from config import (
+    USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_HISTORY, USER_DATA_HISTORY_TOKENS, USER_DATA_HISTORY_SUMMARY,
+    USER_DATA_PERSONA, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY,
+    LLM_CONNECT_TIMEOUT, LLM_REQUEST_TIMEOUT, HISTORY_TOKEN_BUDGET, HISTORY_TRIM_RATIO,
+    HISTORY_MIN_RECENT_MESSAGES, HISTORY_SUMMARY_MAX_WORDS, LLM_EXPECTED_COMPLETION_TOKENS,
+    RESPONSE_CACHE_MAX_MESSAGES, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_QUEUE_DEPTH, SHARD_WORKERS
+)
+from admission import LLMScheduler, SchedulerBusy
+from model_router import ModelRouter
+from resilience import CircuitOpenError, ResilientCaller
+from metrics import (
+    Counter, Gauge, HISTORY_LENGTH, LLM_COMPLETION_TOKENS, LLM_ERRORS, LLM_LATENCY, LLM_PROMPT_TOKENS,
+    LLM_TIME_TO_FIRST_TOKEN
+)
+from history import (
+    ASSISTANT, USER, PromptTurn, TokenLedger, Turn, compress_cold_turns, estimate_tokens, summary_message,
+    summary_request, to_messages, upgrade_history
+)
+from openers import OpenerPool, opener_request, personalize
+from response_cache import ResponseCache, cache_key, generalize, is_cacheable
+from persona_data import PERSONAS, PersonaError
 
-# Initialize the OpenAI client, which is pre-configured to use the Gemini API
-# The base_url and api_key are automatically handled by the sandbox environment
-client = OpenAI()
+logger = logging.getLogger(__name__)
+
+# The async OpenAI client, which is pre-configured to use the Gemini API, created by
+# get_client() on first use. Importing openai takes most of the bot's startup time, so
+# it is deferred until the client is needed; benchmarks may assign their own client here.
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Returns the shared async OpenAI client, creating it on first use. It may be called
+    from a worker thread to create the client off the event loop (see preload_client).
+    """
+    global client
+    with _client_lock:
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+
+            # The base_url and api_key are automatically handled by the sandbox environment.
+            # A single client (and therefore a single HTTP connection pool) is shared by every
+            # chat, so concurrent turns reuse warm keep-alive connections instead of each
+            # paying for a fresh TCP/TLS handshake.
+            # Retries are left to resilient_caller, which bounds them by the call deadline.
+            client = AsyncOpenAI(
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                    ),
+                    # openai's own Timeout type, which matches the HTTP library it was built against
+                    timeout=Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                ),
+            )
+        return client
+
+async def preload_client():
+    """Creates the client in a worker thread, so the first model call doesn't stall the event loop."""
+    await asyncio.to_thread(get_client)
+
+# Admission control shared by every model call. Sharded workers each admit their share
+# of the provider budget, so together they stay within it.
+_shards = max(SHARD_WORKERS, 1)
+llm_scheduler = LLMScheduler(
+    requests_per_minute=LLM_REQUESTS_PER_MINUTE / _shards,
+    tokens_per_minute=LLM_TOKENS_PER_MINUTE / _shards,
+    max_queue_depth=max(LLM_MAX_QUEUE_DEPTH // _shards, 1),
+)
+
+# Deadlines, retries, hedging and circuit breaking shared by every model call
+resilient_caller = ResilientCaller()
+
+# Picks the model tier and generation limits of every model call
+model_router = ModelRouter()
+
+def _expected_completion(route):
+    """Completion tokens budgeted for a call on `route` before its actual usage is known."""
+    return min(LLM_EXPECTED_COMPLETION_TOKENS, route.max_tokens)
+
+def _failure_message(error, fallback):
+    """The reply sent to the user when a model call failed with `error`."""
+    if isinstance(error, SchedulerBusy):
+        return (
+            f"⏳ I'm talking with a lot of people right now and the queue is full (position {error.position}). "
+            "Please try again in a minute."
+        )
+    if isinstance(error, CircuitOpenError):
+        return "⚠️ The AI service is having trouble right now. Please try again in a few minutes."
+    return fallback
+
+async def _generate_opener(persona_name):
+    """Generates an opener for the pool, with name/goal markers in place of user details."""
+    service = AIService({USER_DATA_PERSONA: persona_name})
+    return await service._complete(opener_request(persona_name), service._route("opener"))
+
+# Pre-generated persona openers, shared by every chat. Openers of edited personas are
+# regenerated when the personas are reloaded.
+opener_pool = OpenerPool(_generate_opener)
+PERSONAS.add_listener(opener_pool.reset)
+
+# Replies shared between identical early conversations of personas that opt in
+response_cache = ResponseCache()
+
+# Scrape-time metrics for the shared call machinery
+Gauge("llm_queue_depth", "Model calls waiting for admission.", function=lambda: llm_scheduler.queue_depth)
+Counter("llm_admitted_total", "Model calls admitted.", function=lambda: llm_scheduler.admitted)
+Counter("llm_shed_total", "Model calls shed because the queue was full.", function=lambda: llm_scheduler.rejected)
+Counter("llm_admission_wait_seconds_total", "Total time calls waited for admission.",
+        function=lambda: llm_scheduler.wait_seconds_total)
+Counter("llm_retries_total", "Model call attempts retried.", function=lambda: resilient_caller.retries)
+Counter("llm_hedges_total", "Hedged model call attempts.", function=lambda: resilient_caller.hedges)
+Counter("llm_route_slo_fallbacks_total", "Model calls sent to a faster tier because theirs violated the SLO.",
+        function=lambda: model_router.fallbacks)
+Gauge("llm_circuit_open", "1 while the circuit breaker is failing calls fast.",
+      function=lambda: int(resilient_caller.breaker.state != "closed"))
+Counter("opener_pool_hits_total", "Simulations started with a pre-generated opener.",
+        function=lambda: opener_pool.hits)
+Counter("opener_pool_misses_total", "Simulations that had to wait for a live opener.",
+        function=lambda: opener_pool.misses)
+Counter("response_cache_hits_total", "Replies served from the response cache.", function=lambda: response_cache.hits)
+Counter("response_cache_disk_hits_total", "Response cache hits found only in the on-disk tier.",
+        function=lambda: response_cache.disk_hits)
+Counter("response_cache_misses_total", "Cacheable turns that needed a model call.",
+        function=lambda: response_cache.misses)
+Gauge("response_cache_entries", "Replies held in the in-memory response cache.", function=lambda: len(response_cache))
 
 class AIService:
     """
     Handles all interactions with the Gemini API, managing conversation history
     and persona-specific system prompts.
+
+    All model calls are awaited on the shared async client, so a slow completion
+    for one chat never blocks the event loop for the others.
     """
 
-    def __init__(self, user_data):
+    def __init__(self, user_data, on_queued=None):
         """
         Initializes the service with the user_data dictionary from the Telegram context.
         This allows the service to manage the conversation history stored in user_data.
+
+        `on_queued`, if given, is awaited with the queue position when a model call
+        has to wait behind many others.
         """
         self.user_data = user_data
+        self.on_queued = on_queued
+        # Admission control serves sessions round-robin; each user_data is one session
+        self.owner = id(user_data)
 
     def _get_history(self):
         """Retrieves or initializes the conversation history for the current chat."""
         if USER_DATA_HISTORY not in self.user_data:
             self.user_data[USER_DATA_HISTORY] = []
-        return self.user_data[USER_DATA_HISTORY]
+        return upgrade_history(self.user_data[USER_DATA_HISTORY])
+
+    def _get_ledger(self):
+        """Retrieves or initializes the cached token counts for the history."""
+        if USER_DATA_HISTORY_TOKENS not in self.user_data:
+            self.user_data[USER_DATA_HISTORY_TOKENS] = TokenLedger()
+        return self.user_data[USER_DATA_HISTORY_TOKENS]
+
+    def _get_persona(self):
+        """Returns the active persona, or None if there is none."""
+        try:
+            return PERSONAS.resolve(self.user_data.get(USER_DATA_PERSONA))
+        except PersonaError:
+            return None
+
+    def _get_token_budget(self):
+        """Returns the history token budget for the active persona."""
+        persona = self._get_persona()
+        return (persona and persona.history_token_budget) or HISTORY_TOKEN_BUDGET
+
+    def _route(self, kind, user_message=""):
+        """Routes a model call of `kind` ("opener", "turn" or "summary") for the active persona."""
+        return model_router.route(self._get_persona(), kind, user_message, self._get_ledger().total)
+
+    def _user_details(self):
+        return self.user_data.get(USER_DATA_NAME, ""), self.user_data.get(USER_DATA_GOAL, "")
+
+    def _cache_key(self, history, route):
+        """Response cache key for a call on `route` with the `history` turns, or None if the reply must not be shared."""
+        persona = self.user_data.get(USER_DATA_PERSONA)
+        if (not response_cache.enabled or persona not in PERSONAS or not PERSONAS[persona].cache_responses
+                or len(history) > RESPONSE_CACHE_MAX_MESSAGES):
+            return None
+        user_name, user_goal = self._user_details()
+        if not is_cacheable(user_name, user_goal):
+            return None
+        return cache_key(persona, route.model, route.temperature, route.max_tokens, history, user_name, user_goal)
+
+    def _cached_reply(self, history, route):
+        """Returns a cached reply to the `history` turns, personalized for this user, or None."""
+        key = self._cache_key(history, route)
+        if key is None:
+            return None
+        reply = response_cache.get(key)
+        return personalize(reply, *self._user_details()) if reply is not None else None
+
+    def _cache_reply(self, history, route, reply):
+        """
+        Offers the reply to the `history` turns to the response cache. A reply that mentions
+        the user's name or goal is not shared: a name like Will or Mark can't be told apart
+        from the word, so the reply can't be personalized for another user safely.
+        """
+        if generalize(reply, *self._user_details()) == reply:
+            self._cache_template(history, route, reply)
+
+    def _cache_template(self, history, route, template):
+        """Caches `template`, a reply to the `history` turns with the name and goal markers already in place."""
+        key = self._cache_key(history, route)
+        if key is not None:
+            response_cache.put(key, template)
+
+    def _discard_last_message(self, history):
+        """Removes the last message from the history, keeping the token cache aligned."""
+        history.pop()
+        self._get_ledger().truncate(len(history))
+
+    async def _fit_history(self, history):
+        """
+        Keeps the history within the persona's token budget.
+
+        When the budget is exceeded, the oldest turns after the pinned persona prompt
+        are folded into the running summary until the history is back under
+        HISTORY_TRIM_RATIO of the budget. Only the newly folded turns and the previous
+        summary are sent to the model, so the summary is updated incrementally.
+        """
+        ledger = self._get_ledger()
+        budget = self._get_token_budget()
+        if ledger.sync(history) <= budget:
+            return
+
+        summary = self.user_data.get(USER_DATA_HISTORY_SUMMARY)
+        start = 2 if summary is not None else 1
+        end = start
+        remaining = ledger.total
+        target = budget * HISTORY_TRIM_RATIO
+        while end < len(history) - HISTORY_MIN_RECENT_MESSAGES and remaining > target:
+            remaining -= ledger.counts[end]
+            end += 1
+        if end == start:
+            return
 
-    def set_persona(self, persona_name, user_name, user_goal):
+        try:
+            summary = await self._complete(summary_request(
+                summary, history[start:end], self.user_data.get(USER_DATA_PERSONA), HISTORY_SUMMARY_MAX_WORDS
+            ), self._route("summary"))
+        except Exception as e:
+            # Keep the full history; folding is retried on the next turn.
+            logger.warning("Error summarizing conversation history: %s", e)
+            return
+
+        folded = [summary_message(summary)]
+        history[1:end] = folded
+        ledger.replace(1, end, folded)
+        self.user_data[USER_DATA_HISTORY_SUMMARY] = summary
+
+    async def _admit(self, messages, route, priority=False):
+        """Waits for admission control and returns the number of tokens budgeted for the call."""
+        tokens = sum(estimate_tokens(message["content"]) for message in messages) + _expected_completion(route)
+        await llm_scheduler.acquire(self.owner, tokens, priority=priority, on_queued=self.on_queued)
+        return tokens
+
+    def _readmit(self, tokens, priority=False):
+        """
+        Returns the `admit` callable for resilient_caller: every retry and hedge waits for
+        admission again, so a 429 storm can't multiply the requests sent past the budgets.
+        """
+        return lambda: llm_scheduler.acquire(self.owner, tokens, priority=priority)
+
+    def _record_usage(self, prompt_tokens, completion_tokens):
+        """Counts the tokens of a model call against the active persona."""
+        persona = self.user_data.get(USER_DATA_PERSONA, "none")
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, persona=persona)
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, persona=persona)
+
+    async def _complete(self, messages, route, priority=False):
+        """Sends the given messages to the model on `route` and returns the reply text."""
+        model_router.record(route, self.user_data.get(USER_DATA_PERSONA))
+        # The latency SLO covers the wait for admission too
+        queued = time.perf_counter()
+        tokens = await self._admit(messages, route, priority)
+        HISTORY_LENGTH.observe(len(messages))
+        start = time.perf_counter()
+        try:
+            response = await resilient_caller.call(lambda: get_client().chat.completions.create(
+                model=route.model,
+                messages=messages,
+                temperature=route.temperature,
+                max_tokens=route.max_tokens,
+            ), admit=self._readmit(tokens, priority))
+        except Exception as e:
+            LLM_ERRORS.inc(error=type(e).__name__)
+            model_router.observe(route, time.perf_counter() - queued)
+            raise
+        LLM_LATENCY.observe(time.perf_counter() - start, kind="complete")
+        completion_tokens = None
+        if response.usage:
+            completion_tokens = response.usage.completion_tokens
+            self._record_usage(response.usage.prompt_tokens, completion_tokens)
+            llm_scheduler.settle(tokens, response.usage.total_tokens)
+        model_router.observe(route, time.perf_counter() - queued, completion_tokens)
+        return response.choices[0].message.content
+
+    async def _open_stream(self, messages, route):
+        """
+        Starts a streamed completion and waits for its first text, so that a slow or
+        failed start can still be retried. Returns the first text, the stream and its
+        remaining chunks.
+        """
+        stream = await get_client().chat.completions.create(
+            model=route.model,
+            messages=messages,
+            temperature=route.temperature,
+            max_tokens=route.max_tokens,
+            stream=True,
+        )
+        try:
+            chunks = aiter(stream)
+            async for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return chunk.choices[0].delta.content, stream, chunks
+            return "", stream, chunks
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def _stream(self, messages, route):
+        """Streams the model's reply to the given messages on `route`, yielding text deltas."""
+        model_router.record(route, self.user_data.get(USER_DATA_PERSONA))
+        queued = time.perf_counter()
+        tokens = await self._admit(messages, route)
+        HISTORY_LENGTH.observe(len(messages))
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + resilient_caller.deadline
+        # For streams, the latency SLO applies to the time to the first text
+        first_text = None
+        try:
+            # Hedging doesn't apply to streams; deadlines and retries cover the time to first text
+            streamed, stream, chunks = await resilient_caller.call(
+                lambda: self._open_stream(messages, route), hedge=False, admit=self._readmit(tokens)
+            )
+            first_text = time.perf_counter()
+            LLM_TIME_TO_FIRST_TOKEN.observe(first_text - start)
+            try:
+                if streamed:
+                    yield streamed
+                while True:
+                    # The rest of the call deadline bounds the stream too, so a stalled one can't hang the turn
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), max(deadline - loop.time(), 0))
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        streamed += chunk.choices[0].delta.content
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+        except Exception as e:
+            LLM_ERRORS.inc(error=type(e).__name__)
+            model_router.observe(route, (first_text or time.perf_counter()) - queued)
+            raise
+        LLM_LATENCY.observe(time.perf_counter() - start, kind="stream")
+        prompt_tokens = tokens - _expected_completion(route)
+        completion_tokens = estimate_tokens(streamed)
+        self._record_usage(prompt_tokens, completion_tokens)
+        llm_scheduler.settle(tokens, prompt_tokens + completion_tokens)
+        model_router.observe(route, first_text - queued, completion_tokens)
+
+    async def set_persona(self, persona_name, user_name, user_goal):
         """
         Sets the active persona and initializes the conversation history
         with the persona's system prompt, personalized with user data.
@@ -33,36 +384,44 @@ class AIService:
         if persona_name not in PERSONAS:
             raise ValueError(f"Unknown persona: {persona_name}")
 
-        # 1. Format the system prompt with user-specific data
-        raw_prompt = PERSONAS[persona_name]["prompt"]
-        system_prompt = raw_prompt.format(user_name=user_name, user_goal=user_goal)
-
-        # 2. Initialize the history with the system prompt
+        # 1. Initialize the history with the system prompt
         # The Gemini API expects the system prompt as the first message in the history
         # with the 'role' set to 'system' or 'user' for the initial instruction.
         # We will use the 'user' role for the initial instruction to the model.
-        self.user_data[USER_DATA_HISTORY] = [
-            {"role": "user", "content": system_prompt}
-        ]
+        # The history only refers to the persona's template and the user-specific data;
+        # the prompt text is formatted when it is sent.
+        self.reset_history()
+        history = self.user_data[USER_DATA_HISTORY] = [PromptTurn(persona_name, user_name, user_goal)]
 
-        # 3. Get the AI's first message to start the conversation
+        # 2. Serve a cached or pre-generated opener if one is available. It is committed
+        # to the history exactly as a live response would be. Personas with cached
+        # responses share one opener, so that their next turns can hit the cache too.
+        route = self._route("opener")
+        opener = self._cached_reply(history, route)
+        if opener is None:
+            template = opener_pool.take(persona_name)
+            if template is not None:
+                self._cache_template(history, route, template)
+                opener = personalize(template, user_name, user_goal)
+        if opener is not None:
+            history.append(Turn(ASSISTANT, opener))
+            return opener
+
+        # 3. Otherwise get the AI's first message to start the conversation
         # We send an empty message to prompt the AI to start the conversation based on the system prompt
         # This is a common pattern to get the AI to speak first.
         try:
-            response = client.chat.completions.create(
-                model=GEMINI_MODEL,
-                messages=self.user_data[USER_DATA_HISTORY],
-                temperature=0.7,
-            )
-            ai_response = response.choices[0].message.content
-            self.user_data[USER_DATA_HISTORY].append({"role": "assistant", "content": ai_response})
+            # Openers jump the admission queue so new sessions start quickly
+            ai_response = await self._complete(to_messages(history), route, priority=True)
+            self._cache_reply(history, route, ai_response)
+            history.append(Turn(ASSISTANT, ai_response))
             return ai_response
         except Exception as e:
-            print(f"Error setting persona and getting first response: {e}")
-            return "Sorry, I ran into an error starting the simulation. Please try again."
+            logger.warning("Error setting persona and getting first response: %s", e)
+            return _failure_message(e, "Sorry, I ran into an error starting the simulation. Please try again.")
 
 
-    def get_response(self, user_message):
+    async def get_response(self, user_message):
         """
         Appends the user message, calls the Gemini API with the full history,
         and appends the AI response.
@@ -70,28 +429,74 @@ class AIService:
         history = self._get_history()
 
         # 1. Append user message
-        history.append({"role": "user", "content": user_message})
+        history.append(Turn(USER, user_message))
 
         # 2. Call the API
         try:
-            response = client.chat.completions.create(
-                model=GEMINI_MODEL,
-                messages=history,
-                temperature=0.7,
-            )
-            ai_response = response.choices[0].message.content
+            await self._fit_history(history)
+            route = self._route("turn", user_message)
+            ai_response = self._cached_reply(history, route)
+            if ai_response is None:
+                ai_response = await self._complete(to_messages(history), route)
+                self._cache_reply(history, route, ai_response)
 
             # 3. Append AI response
-            history.append({"role": "assistant", "content": ai_response})
+            history.append(Turn(ASSISTANT, ai_response))
+            compress_cold_turns(history)
 
             return ai_response
         except Exception as e:
-            print(f"Error getting AI response: {e}")
+            logger.warning("Error getting AI response: %s", e)
+            # Remove the last user message to prevent history corruption
+            self._discard_last_message(history)
+            return _failure_message(e, "Sorry, I ran into an error processing your message. Please try again.")
+
+    async def stream_response(self, user_message):
+        """
+        Streaming variant of get_response. Yields the reply accumulated so far
+        each time the model sends more text.
+
+        Only the complete reply is committed to the history. If the stream fails,
+        the user message is removed again and the error text is yielded as the
+        final value, exactly as get_response would return it.
+        """
+        history = self._get_history()
+
+        # 1. Append user message
+        history.append(Turn(USER, user_message))
+
+        # 2. Stream the API response
+        ai_response = ""
+        try:
+            await self._fit_history(history)
+            route = self._route("turn", user_message)
+            cached = self._cached_reply(history, route)
+            if cached is not None:
+                ai_response = cached
+                yield ai_response
+            else:
+                async for delta in self._stream(to_messages(history), route):
+                    ai_response += delta
+                    yield ai_response
+                if not ai_response:
+                    raise ValueError("The model returned an empty response.")
+                self._cache_reply(history, route, ai_response)
+        except Exception as e:
+            logger.warning("Error streaming AI response: %s", e)
             # Remove the last user message to prevent history corruption
-            history.pop()
-            return "Sorry, I ran into an error processing your message. Please try again."
+            self._discard_last_message(history)
+            yield _failure_message(e, "Sorry, I ran into an error processing your message. Please try again.")
+            return
+        except BaseException:
+            # The consumer went away (e.g. cancellation) before the reply was complete
+            self._discard_last_message(history)
+            raise
+
+        # 3. Append the complete AI response
+        history.append(Turn(ASSISTANT, ai_response))
+        compress_cold_turns(history)
 
     def reset_history(self):
-        """Clears the conversation history."""
-        if USER_DATA_HISTORY in self.user_data:
-            del self.user_data[USER_DATA_HISTORY]
+        """Clears the conversation history, its token counts and running summary."""
+        for key in (USER_DATA_HISTORY, USER_DATA_HISTORY_TOKENS, USER_DATA_HISTORY_SUMMARY):
+            self.user_data.pop(key, None)
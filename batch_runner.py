@@ -0,0 +1,338 @@
+"""
+Offline batch runner: replays scripted conversations against the personas through
+AIService, without Telegram.
+
+Scripts are read from a JSONL file, one conversation per line:
+
+    {"id": "pitch-01", "name": "Alex", "goal": "to get better at pitching",
+     "messages": ["We sell software to dentists.", "About $1M a year."], "personas": ["Investor"]}
+
+`name`, `goal` and `personas` are optional; a script without `personas` is run
+against every persona. Each (script, persona) pair is one conversation: the persona's
+opener, then one turn per message. Up to --parallel conversations run at once, all
+through the same admission control, retries and model routing as the bot.
+
+Every finished conversation is appended to the output JSONL file straight away,
+which doubles as the checkpoint: with --resume, conversations already in the file
+are skipped, so an interrupted run picks up where it stopped. The opener pool and
+response cache are off, so every reply comes from the model. At the end, latency
+and token totals per persona are printed for all conversations in the output file.
+The exit status is 1 if any turn failed.
+
+Usage:
+    python batch_runner.py scripts.jsonl --output results.jsonl --parallel 16
+    python batch_runner.py scripts.jsonl --resume
+    python batch_runner.py benchmarks/batch_scripts.jsonl --fake   # in-process fake endpoint, for CI
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from config import (
+    BATCH_PARALLELISM, BATCH_OUTPUT_PATH, USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_PERSONA
+)
+import ai_service
+from ai_service import AIService, opener_pool, response_cache
+from history import ASSISTANT
+from persona_data import PERSONAS
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.WARNING
+)
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_NAME = "Alex"
+DEFAULT_GOAL = "to practice a difficult conversation"
+
+
+class ScriptError(ValueError):
+    """A line of the scripts file is not a valid script."""
+
+
+def parse_script(data, personas):
+    """Validates one script and returns it with its defaults filled in."""
+    if not isinstance(data, dict):
+        raise ScriptError("expected an object")
+    if not isinstance(data.get("id"), str) or not data["id"]:
+        raise ScriptError("'id' must be a non-empty string")
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages or not all(isinstance(m, str) and m for m in messages):
+        raise ScriptError("'messages' must be a non-empty list of non-empty strings")
+    for field in ("name", "goal"):
+        if not isinstance(data.get(field, ""), str):
+            raise ScriptError(f"{field!r} must be a string")
+    names = data.get("personas", personas)
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ScriptError("'personas' must be a list of persona names")
+    unknown = [name for name in names if name not in PERSONAS]
+    if unknown:
+        raise ScriptError(f"unknown personas: {', '.join(unknown)}")
+    return {
+        "id": data["id"], "name": data.get("name") or DEFAULT_NAME, "goal": data.get("goal") or DEFAULT_GOAL,
+        "messages": messages, "personas": [name for name in names if name in personas],
+    }
+
+
+def read_scripts(path, personas):
+    """Yields the scripts in the JSONL file at `path`, restricted to `personas`, one line at a time."""
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                script = parse_script(json.loads(line), personas)
+            except ValueError as e:  # bad JSON or an invalid script
+                raise ScriptError(f"{path}:{number}: {e}") from None
+            if script["id"] in seen:
+                raise ScriptError(f"{path}:{number}: script {script['id']!r} appears twice")
+            seen.add(script["id"])
+            yield script
+
+
+def conversation_key(script_id, persona_name):
+    return f"{script_id}/{persona_name}"
+
+
+def read_results(path):
+    """
+    Yields the results in the output file at `path`. A last line cut short by an
+    interruption is removed from the file, so the conversation runs again.
+    """
+    complete = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            yield json.loads(line)
+    if complete < os.path.getsize(path):
+        logger.warning("Dropping an incomplete result at the end of %s", path)
+        with open(path, "rb+") as f:
+            f.truncate(complete)
+
+
+class BatchService(AIService):
+    """AIService that also counts the tokens and tiers of its own model calls."""
+
+    def __init__(self, user_data):
+        super().__init__(user_data)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tiers = []
+
+    def _record_usage(self, prompt_tokens, completion_tokens):
+        super()._record_usage(prompt_tokens, completion_tokens)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    async def _complete(self, messages, route, priority=False):
+        self.tiers.append(route.tier)
+        return await super()._complete(messages, route, priority)
+
+    async def _stream(self, messages, route):
+        self.tiers.append(route.tier)
+        async for delta in super()._stream(messages, route):
+            yield delta
+
+    def _committed(self, reply):
+        """Whether the last call succeeded, i.e. `reply` was added to the history rather than an error text."""
+        history = self._get_history()
+        return bool(history) and history[-1].role == ASSISTANT and history[-1].content is reply
+
+    async def _measure(self, call):
+        """Runs `call` and returns its step record: reply, timings, tokens, tier and outcome."""
+        prompt_tokens, completion_tokens, calls = self.prompt_tokens, self.completion_tokens, len(self.tiers)
+        start = time.perf_counter()
+        reply, first_text = await call()
+        step = {
+            "reply": reply,
+            "latency": round(time.perf_counter() - start, 4),
+            "prompt_tokens": self.prompt_tokens - prompt_tokens,
+            "completion_tokens": self.completion_tokens - completion_tokens,
+            "tiers": self.tiers[calls:],
+            "ok": self._committed(reply),
+        }
+        if first_text is not None:
+            step["first_text"] = round(first_text - start, 4)
+        return step
+
+    async def _reply(self, message, stream):
+        if not stream:
+            return await self.get_response(message), None
+        reply, first_text = "", None
+        async for reply in self.stream_response(message):
+            first_text = first_text or time.perf_counter()
+        return reply, first_text
+
+
+async def run_conversation(script, persona_name, stream=False):
+    """Runs `script` against one persona and returns the conversation's result record."""
+    user_data = {USER_DATA_NAME: script["name"], USER_DATA_GOAL: script["goal"], USER_DATA_PERSONA: persona_name}
+    service = BatchService(user_data)
+    start = time.perf_counter()
+
+    async def opener():
+        return await service.set_persona(persona_name, script["name"], script["goal"]), None
+
+    turns = []
+    opener_step = await service._measure(opener)
+    if opener_step["ok"]:
+        for message in script["messages"]:
+            step = await service._measure(lambda: service._reply(message, stream))
+            turns.append({"user": message, **step})
+    return {
+        "key": conversation_key(script["id"], persona_name),
+        "script": script["id"],
+        "persona": persona_name,
+        "opener": opener_step,
+        "turns": turns,
+        "ok": opener_step["ok"] and all(turn["ok"] for turn in turns),
+        "elapsed": round(time.perf_counter() - start, 4),
+        "prompt_tokens": service.prompt_tokens,
+        "completion_tokens": service.completion_tokens,
+    }
+
+
+async def run_batch(scripts, output, done, parallel, stream):
+    """
+    Runs every conversation of `scripts` not in `done`, `parallel` at a time, appending
+    each result to the `output` file as it finishes. Returns the number of conversations run.
+    """
+    conversations = (
+        (script, persona_name) for script in scripts for persona_name in script["personas"]
+        if conversation_key(script["id"], persona_name) not in done
+    )
+    finished = 0
+
+    async def worker():
+        nonlocal finished
+        # Workers share one lazy iterator, so scripts are only read as they are needed
+        for script, persona_name in conversations:
+            result = await run_conversation(script, persona_name, stream)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            finished += 1
+            if not result["ok"]:
+                logger.warning("Conversation %s had failed turns", result["key"])
+
+    await asyncio.gather(*(worker() for _ in range(max(parallel, 1))))
+    return finished
+
+
+def summarize(path):
+    """Latency and token totals per persona over every result in the output file."""
+    personas = {}
+    for result in read_results(path):
+        stats = personas.setdefault(result["persona"], {
+            "conversations": 0, "failed": 0, "turns": 0, "failed_turns": 0, "latencies": [],
+            "prompt_tokens": 0, "completion_tokens": 0,
+        })
+        stats["conversations"] += 1
+        stats["failed"] += not result["ok"]
+        stats["prompt_tokens"] += result["prompt_tokens"]
+        stats["completion_tokens"] += result["completion_tokens"]
+        for turn in result["turns"]:
+            stats["turns"] += 1
+            stats["failed_turns"] += not turn["ok"]
+            stats["latencies"].append(turn["latency"])
+    for stats in personas.values():
+        latencies = sorted(stats.pop("latencies"))
+        stats["latency_p50"] = statistics.median(latencies) if latencies else None
+        stats["latency_p95"] = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None
+    # In menu order, then any personas that have since been removed
+    order = {name: index for index, name in enumerate(PERSONAS)}
+    return dict(sorted(personas.items(), key=lambda item: order.get(item[0], len(order))))
+
+
+def print_summary(personas):
+    print(f"{'persona':<16} {'convs':>6} {'failed':>6} {'turns':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'prompt tok':>11} {'compl tok':>10}")
+    for name, stats in personas.items():
+        p50, p95 = (f"{stats[key] * 1000:8.0f}" if stats[key] is not None else f"{'-':>8}"
+                    for key in ("latency_p50", "latency_p95"))
+        print(f"{name:<16} {stats['conversations']:6d} {stats['failed']:6d} {stats['turns']:6d} {p50} {p95} "
+              f"{stats['prompt_tokens']:11d} {stats['completion_tokens']:10d}")
+
+
+async def start_fake_endpoint():
+    """Starts benchmarks/fake_openai.py in this process and returns its base URL."""
+    sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+    from fake_openai import FakeOpenAI
+
+    server = await FakeOpenAI(latency=0.05, jitter=0.01, tokens_per_sec=2000).serve()
+    return f"{server.url}/v1"
+
+
+async def run(args):
+    personas = args.personas.split(",") if args.personas else list(PERSONAS)
+    unknown = [name for name in personas if name not in PERSONAS]
+    if unknown:
+        raise ScriptError(f"unknown personas: {', '.join(unknown)}")
+
+    if args.fake:
+        args.base_url = await start_fake_endpoint()
+    if args.base_url:
+        # Read by the OpenAI client, which is only created on the first model call
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "batch")
+    # Every reply should come from the model
+    opener_pool.pool_size = 0
+    response_cache.max_entries = 0
+
+    done = set()
+    if os.path.exists(args.output) and not args.overwrite:
+        if not args.resume:
+            raise ScriptError(f"{args.output} exists; pass --resume to continue it or --overwrite to start over")
+        done = {result["key"] for result in read_results(args.output)}
+        print(f"Resuming: {len(done)} conversations already in {args.output}")
+
+    start = time.perf_counter()
+    with open(args.output, "w" if args.overwrite else "a", encoding="utf-8") as output:
+        finished = await run_batch(read_scripts(args.scripts, personas), output, done, args.parallel, args.stream)
+    elapsed = time.perf_counter() - start
+    print(f"Ran {finished} conversations in {elapsed:.1f}s ({finished / elapsed if elapsed else 0:.2f}/s), "
+          f"results in {args.output}")
+    if ai_service.client is not None:
+        await ai_service.client.close()
+
+    personas = summarize(args.output)
+    print_summary(personas)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(personas, f, indent=2)
+    return any(stats["failed"] for stats in personas.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scripts", help="JSONL file with one scripted conversation per line")
+    parser.add_argument("--output", default=BATCH_OUTPUT_PATH, help="JSONL file the results are appended to")
+    parser.add_argument("--personas", help="comma-separated personas to run (default: all)")
+    parser.add_argument("--parallel", type=int, default=BATCH_PARALLELISM, help="conversations run at once")
+    parser.add_argument("--stream", action="store_true", help="stream replies and record the time to first text")
+    parser.add_argument("--resume", action="store_true", help="skip conversations already in the output file")
+    parser.add_argument("--overwrite", action="store_true", help="start over, replacing the output file")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint to use instead of the configured one")
+    parser.add_argument("--fake", action="store_true", help="run against an in-process fake endpoint")
+    parser.add_argument("--summary", help="also write the per-persona summary to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        failed = asyncio.run(run(args))
+    except ScriptError as e:
+        print(f"ERROR: {e}")
+        sys.exit(2)
+    except KeyboardInterrupt:
+        print(f"Interrupted. Finished conversations are in {args.output}; rerun with --resume to continue.")
+        sys.exit(130)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
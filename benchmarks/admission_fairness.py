@@ -0,0 +1,70 @@
+"""
+Exercises the LLM admission scheduler with one heavy user and many light users.
+
+Requests-per-minute is set low enough that calls must queue. The heavy user fires
+a large batch of calls up front; light users each send a few calls and one
+priority opener. With round-robin fairness the light users' waits stay close to
+the heavy user's instead of sitting behind its whole batch.
+
+Usage:
+    python benchmarks/admission_fairness.py --rpm 600 --heavy-calls 100 --light-users 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import LLMScheduler, SchedulerBusy
+
+
+async def timed_call(scheduler, owner, waits, priority=False):
+    start = time.monotonic()
+    try:
+        await scheduler.acquire(owner, 500, priority=priority)
+    except SchedulerBusy:
+        waits.setdefault("shed", []).append(0)
+        return
+    waits.setdefault("priority" if priority else owner, []).append(time.monotonic() - start)
+
+
+def describe(waits):
+    if not waits:
+        return "n/a (all shed)"
+    return f"mean {statistics.mean(waits):.2f}s, max {max(waits):.2f}s"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--heavy-calls", type=int, default=100)
+    parser.add_argument("--light-users", type=int, default=20)
+    parser.add_argument("--light-calls", type=int, default=3)
+    parser.add_argument("--max-queue-depth", type=int, default=150)
+    args = parser.parse_args()
+
+    scheduler = LLMScheduler(requests_per_minute=args.rpm, tokens_per_minute=0,
+                             max_queue_depth=args.max_queue_depth)
+    # Start with an empty bucket so every call has to queue
+    scheduler._requests.tokens = 0
+    waits = {}
+
+    calls = [timed_call(scheduler, "heavy", waits) for _ in range(args.heavy_calls)]
+    for user in range(args.light_users):
+        calls += [timed_call(scheduler, f"light{user}", waits) for _ in range(args.light_calls)]
+        calls.append(timed_call(scheduler, f"light{user}", waits, priority=True))
+    await asyncio.gather(*calls)
+
+    light = [wait for owner, values in waits.items() if owner.startswith("light") for wait in values]
+    print(f"admitted / shed:        {scheduler.admitted} / {scheduler.rejected}")
+    print(f"priority opener wait:   {describe(waits.get('priority', []))}")
+    print(f"light user wait:        {describe(light)}")
+    print(f"heavy user wait:        {describe(waits.get('heavy', []))}")
+    print(f"scheduler stats:        {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
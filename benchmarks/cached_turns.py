@@ -0,0 +1,78 @@
+"""
+Measures the response cache on early simulation turns.
+
+Simulated users start a cache-enabled persona (Investor or Teacher) and send two
+short messages drawn from a small set of typical first answers, as happens with
+quiz answers and pitch openers. The run is repeated with the cache disabled and
+enabled, comparing model calls, mean turn latency and the cache hit rate.
+
+Usage:
+    python benchmarks/cached_turns.py --users 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import ai_service
+from ai_service import AIService, llm_scheduler, opener_pool, response_cache
+from concurrent_chats import make_client
+from config import USER_DATA_GOAL, USER_DATA_NAME, USER_DATA_PERSONA
+from persona_data import PERSONAS
+
+NAMES = ("Alex", "Priya", "Jordan", "Mateo", "Yuki", "Amara", "Liam", "Sofia")
+GOALS = ("to get better at pitching", "to pass my history exam", "to feel more confident")
+FIRST_ANSWERS = ("1939", "1945", "Pearl Harbor", "I don't know", "We sell software to dentists.",
+                 "Our startup makes meal kits.")
+SECOND_ANSWERS = ("Can you repeat the question?", "Churchill", "Our revenue is $1M a year.", "Next question please.")
+
+
+async def run_users(users, seed):
+    """Runs every user's first turns one after another and returns the mean turn latency."""
+    random.seed(seed)
+    personas = [name for name, persona in PERSONAS.items() if persona.cache_responses]
+    elapsed, turns = 0.0, 0
+    for _ in range(users):
+        # As the /create handler does: name, goal and persona are in user_data before set_persona
+        user_data = {USER_DATA_NAME: random.choice(NAMES), USER_DATA_GOAL: random.choice(GOALS),
+                     USER_DATA_PERSONA: random.choice(personas)}
+        service = AIService(user_data)
+        await service.set_persona(user_data[USER_DATA_PERSONA], user_data[USER_DATA_NAME], user_data[USER_DATA_GOAL])
+        for message in (random.choice(FIRST_ANSWERS), random.choice(SECOND_ANSWERS)):
+            start = time.perf_counter()
+            await service.get_response(message)
+            elapsed += time.perf_counter() - start
+            turns += 1
+    return elapsed / turns
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated model latency in seconds")
+    args = parser.parse_args()
+
+    ai_service.client = make_client(args.latency)
+    # Live openers only, so both runs make the same opener calls
+    opener_pool.pool_size = 0
+
+    cache_size = response_cache.max_entries
+    for label, size in (("cache disabled", 0), ("cache enabled", cache_size)):
+        response_cache.max_entries = size
+        calls_before = llm_scheduler.admitted
+        hits_before, misses_before = response_cache.hits, response_cache.misses
+        mean = await run_users(args.users, seed=1)
+        hits, misses = response_cache.hits - hits_before, response_cache.misses - misses_before
+        lookups = hits + misses
+        print(f"{label:<15} model calls {llm_scheduler.admitted - calls_before:5d}  "
+              f"mean turn {mean * 1000:7.1f} ms  hit rate {hits / lookups if lookups else 0:.0%} "
+              f"({hits} hits, {len(response_cache)} entries)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Measures how long the bot takes to start.
+
+Each run starts a fresh interpreter that imports main.py, builds the Application
+and then creates the model client, which main.py does in the background once the
+bot is up. Reported are the medians over all runs: process start to the end of
+the imports, to a built Application (ready to poll), and to a usable model client,
+plus whether the openai package was loaded before it was needed.
+
+Usage:
+    python benchmarks/cold_start.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.build_application(metrics_port=0)
+built = time.perf_counter()
+openai_loaded = "openai" in sys.modules
+import ai_service
+if hasattr(ai_service, "get_client"):
+    ai_service.get_client()
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "build": built - start, "client": ready - start,
+                  "openai_loaded": openai_loaded}))
+"""
+
+
+def run_once():
+    env = dict(os.environ, TELEGRAM_BOT_TOKEN="123456:cold-start", OPENAI_API_KEY="cold-start",
+               SESSION_BACKEND="memory", METRICS_PORT="0")
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    for key, label in (("import", "imports done"), ("build", "application built"),
+                       ("client", "model client ready"), ("process", "whole process")):
+        print(f"{label:<20} {statistics.median(result[key] for result in results) * 1000:7.1f} ms")
+    print(f"openai imported before the client was needed: {results[0]['openai_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
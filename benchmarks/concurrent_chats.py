@@ -0,0 +1,77 @@
+"""
+Measures how long N simultaneous chats take to get a reply from AIService.
+
+The OpenAI client is pointed at an in-process transport that answers every
+chat completion after a fixed delay, so the numbers reflect the bot's own
+concurrency rather than network conditions. With the async client, N chats
+should finish in roughly the time of a single call.
+
+Usage:
+    python benchmarks/concurrent_chats.py --chats 50 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import httpx
+from openai import AsyncOpenAI
+
+import ai_service
+from ai_service import AIService
+
+
+def make_client(latency):
+    """Builds an AsyncOpenAI client whose completions take `latency` seconds."""
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "benchmark",
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "Tell me more."},
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+        })
+
+    return AsyncOpenAI(
+        base_url="http://benchmark.local/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+async def run_chats(chats):
+    """Sends one message in each chat at the same time and returns the elapsed seconds."""
+    services = [AIService({}) for _ in range(chats)]
+    start = time.perf_counter()
+    await asyncio.gather(*(service.get_response("Hello!") for service in services))
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50, help="number of simultaneous chats")
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated model latency in seconds")
+    args = parser.parse_args()
+
+    ai_service.client = make_client(args.latency)
+
+    single = await run_chats(1)
+    concurrent = await run_chats(args.chats)
+
+    print(f"model latency:      {args.latency:.3f}s")
+    print(f"1 chat:             {single:.3f}s")
+    print(f"{args.chats} chats at once: {concurrent:.3f}s ({concurrent / single:.2f}x a single call)")
+    print(f"serial equivalent:  {single * args.chats:.3f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
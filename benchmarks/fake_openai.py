@@ -0,0 +1,140 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+Answers POST /v1/chat/completions, streamed or not, with configurable latency,
+token rate, slow-tail probability and injected failures (HTTP 500 / 429). Point
+the bot at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8081 --latency 0.3 --tail-rate 0.05 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from stub_http import Response, StubHTTPServer
+
+REPLY_WORDS = (
+    "That is an interesting point and I would like to hear more about how you arrived at it "
+    "before we move on to the next question"
+).split()
+
+
+class FakeOpenAI:
+    """
+    Behaviour of the fake endpoint.
+
+    latency:        seconds before the response starts (mean of an exponential jitter on top of it)
+    jitter:         mean of the exponential jitter added to `latency`
+    tail_rate:      probability a request takes `tail_latency` seconds instead
+    tokens_per_sec: streaming speed; also used to delay non-streamed responses
+    reply_tokens:   (min, max) words per reply
+    error_rate:     probability of a 500 response
+    rate_limit_rate: probability of a 429 response
+    """
+
+    def __init__(self, latency=0.3, jitter=0.05, tail_rate=0.0, tail_latency=5.0, tokens_per_sec=200.0,
+                 reply_tokens=(20, 60), error_rate=0.0, rate_limit_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self.failures_injected = 0
+
+    def _first_token_delay(self):
+        if random.random() < self.tail_rate:
+            return self.tail_latency
+        return self.latency + (random.expovariate(1 / self.jitter) if self.jitter > 0 else 0.0)
+
+    def _reply(self):
+        words = random.randint(*self.reply_tokens)
+        return [random.choice(REPLY_WORDS) for _ in range(words)]
+
+    async def handle(self, request):
+        if request.method != "POST" or not request.path.endswith("/chat/completions"):
+            return Response.json({"error": {"message": "not found"}}, status=404)
+        self.requests += 1
+        body = request.json()
+        model = body.get("model", "fake")
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in body.get("messages", []))
+
+        roll = random.random()
+        if roll < self.error_rate:
+            self.failures_injected += 1
+            await asyncio.sleep(self.latency / 2)
+            return Response.json({"error": {"message": "injected failure", "type": "server_error"}}, status=500)
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.failures_injected += 1
+            return Response.json({"error": {"message": "injected rate limit", "type": "rate_limit"}}, status=429,
+                                 headers={"Retry-After": "1"})
+
+        await asyncio.sleep(self._first_token_delay())
+        words = self._reply()
+        if body.get("stream"):
+            return Response(200, headers={"Content-Type": "text/event-stream"},
+                            chunks=self._stream(model, words))
+
+        await asyncio.sleep(len(words) / self.tokens_per_sec)
+        return Response.json({
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": " ".join(words)}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                      "total_tokens": prompt_tokens + len(words)},
+        })
+
+    async def _stream(self, model, words):
+        for i, word in enumerate(words):
+            chunk = {
+                "id": f"chatcmpl-{self.requests}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                             "finish_reason": None}],
+            }
+            yield b"data: " + json.dumps(chunk).encode() + b"\n\n"
+            await asyncio.sleep(1 / self.tokens_per_sec)
+        yield b"data: [DONE]\n\n"
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """Starts serving and returns the running StubHTTPServer."""
+        return await StubHTTPServer(self.handle, host, port).start()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, tail_rate=args.tail_rate,
+                      tail_latency=args.tail_latency, tokens_per_sec=args.tokens_per_sec,
+                      error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    server = await fake.serve(args.host, args.port)
+    print(f"Fake OpenAI endpoint at {server.url}/v1. Press Ctrl-C to stop.")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
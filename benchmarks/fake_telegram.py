@@ -0,0 +1,182 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+Serves /bot<token>/<method> for the methods the bot uses: getMe, getUpdates
+(long polling), deleteWebhook/setWebhook, sendMessage, editMessageText,
+answerCallbackQuery and sendChatAction. Parameters are read the way
+python-telegram-bot sends them: form fields whose non-string values are JSON
+encoded.
+
+A driver pushes user updates with push_message()/push_callback() and reads
+what the bot sent to a chat with next_event(). Point the bot at it with
+TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot.
+
+With a flood_limit, it enforces Telegram's global send limit the way Telegram
+does: sends beyond flood_limit per second, across all chats, are refused with a 429 and a
+retry_after, and counted in flood_errors.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl
+
+from stub_http import Response, StubHTTPServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Persona Simulator", "username": "persona_simulator_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class BotEvent:
+    """Something the bot did in a chat: a new message or an edit of an existing one."""
+
+    __slots__ = ("method", "message_id", "text", "reply_markup", "time")
+
+    def __init__(self, method, message_id, text, reply_markup):
+        self.method = method
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.time = time.perf_counter()
+
+
+# Calls that count against the send limit
+SEND_METHODS = frozenset({"sendMessage", "editMessageText", "sendChatAction"})
+
+
+class FakeTelegram:
+    def __init__(self, flood_limit=0):
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._new_updates = asyncio.Event()
+        self._events = {}
+        self.polling = asyncio.Event()
+        self.calls = {}
+        self.flood_limit = flood_limit
+        self.flood_errors = 0
+        self._window = (0, 0)  # (second, sends in it)
+
+    # --- Driver side ---
+
+    def _chat(self, chat_id):
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+    def _user(self, chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+
+    def _push(self, **update):
+        self._update_id += 1
+        self._updates.append({"update_id": self._update_id, **update})
+        self._new_updates.set()
+
+    def push_message(self, chat_id, text):
+        """Queues a private text message from user `chat_id`. Returns its message_id."""
+        self._message_id += 1
+        message = {"message_id": self._message_id, "date": int(time.time()), "chat": self._chat(chat_id),
+                   "from": self._user(chat_id), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._push(message=message)
+        return self._message_id
+
+    def push_callback(self, chat_id, data, message_id):
+        """Queues a press of an inline button with callback `data` on the bot's message `message_id`."""
+        message = {"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id),
+                   "from": BOT_USER, "text": "…"}
+        self._push(callback_query={"id": f"{chat_id}:{message_id}", "from": self._user(chat_id),
+                                   "chat_instance": str(chat_id), "data": data, "message": message})
+
+    def events(self, chat_id):
+        """The queue of BotEvents for `chat_id`."""
+        queue = self._events.get(chat_id)
+        if queue is None:
+            queue = self._events[chat_id] = asyncio.Queue()
+        return queue
+
+    async def next_event(self, chat_id):
+        return await self.events(chat_id).get()
+
+    # --- Bot API side ---
+
+    async def handle(self, request):
+        _, _, method = request.path.rpartition("/")
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = self._params(request)
+        if method in SEND_METHODS and self._flooded():
+            self.flood_errors += 1
+            return Response.json({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                  "parameters": {"retry_after": 1}}, status=429)
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return Response.json({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        return Response.json({"ok": True, "result": await handler(params)})
+
+    def _flooded(self):
+        if not self.flood_limit:
+            return False
+        second, sends = self._window
+        now = int(time.monotonic())
+        if now != second:
+            second, sends = now, 0
+        self._window = (second, sends + 1)
+        return sends >= self.flood_limit
+
+    @staticmethod
+    def _params(request):
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return request.json()
+        params = {}
+        for name, value in parse_qsl(request.body.decode()):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                # Strings are sent as-is
+                params[name] = value
+        return params
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_deleteWebhook(self, params):
+        return True
+
+    async def _api_setWebhook(self, params):
+        return True
+
+    async def _api_getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset", 0))
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit", 100))]
+
+    def _record(self, method, params, message_id):
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text", ""))
+        self.events(chat_id).put_nowait(BotEvent(method, message_id, text, params.get("reply_markup")))
+        return {"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id),
+                "from": BOT_USER, "text": text}
+
+    async def _api_sendMessage(self, params):
+        self._message_id += 1
+        return self._record("sendMessage", params, self._message_id)
+
+    async def _api_editMessageText(self, params):
+        return self._record("editMessageText", params, int(params["message_id"]))
+
+    async def _api_answerCallbackQuery(self, params):
+        return True
+
+    async def _api_sendChatAction(self, params):
+        return True
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """Starts serving and returns the running StubHTTPServer."""
+        return await StubHTTPServer(self.handle, host, port).start()
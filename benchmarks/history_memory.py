@@ -0,0 +1,99 @@
+"""
+Measures the memory a conversation history takes per session.
+
+Synthetic sessions get a persona and a conversation of --turns user/assistant
+pairs, built three ways: the previous layout of OpenAI-style dicts with the
+formatted persona prompt copied into every session, the compact turn records,
+and the compact records with cold turns compressed. Reported per session are the
+bytes allocated while building the histories (tracemalloc) and the pickled size
+that the session store writes to disk.
+
+Usage:
+    python benchmarks/history_memory.py --sessions 10000 --turns 10
+"""
+import argparse
+import gc
+import os
+import pickle
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from history import ASSISTANT, USER, PromptTurn, Turn, compress_cold_turns
+from persona_data import PERSONAS
+
+GOALS = ("to get better at pitching", "to pass my history exam", "to feel more confident")
+WORDS = ("market", "growth", "customers", "revenue", "team", "product", "idea", "plan", "question", "answer",
+         "really", "think", "because", "would", "about", "that", "the", "we", "our", "and")
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def conversation(rng, turns):
+    """The (role, content) pairs of one synthetic conversation: short user messages, longer replies."""
+    messages = []
+    for _ in range(turns):
+        messages.append((USER, sentence(rng, rng.randint(5, 30))))
+        messages.append((ASSISTANT, " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6)))))
+    return messages
+
+
+def dict_history(persona, user_name, user_goal, messages):
+    history = [{"role": "user", "content": PERSONAS[persona].render(user_name, user_goal)}]
+    history.extend({"role": role, "content": content} for role, content in messages)
+    return history
+
+
+def compact_history(persona, user_name, user_goal, messages, compress_after=0):
+    history = [PromptTurn(persona, user_name, user_goal)]
+    for role, content in messages:
+        history.append(Turn(role, content))
+        compress_cold_turns(history, appended=1, keep_recent=compress_after)
+    return history
+
+
+def measure(build, sessions, turns):
+    """Returns the bytes allocated and pickled per session for histories made by `build`."""
+    rng = random.Random(1)
+    personas = list(PERSONAS)
+    inputs = [(rng.choice(personas), f"User {i}", rng.choice(GOALS), conversation(rng, turns)) for i in range(sessions)]
+    # Message text arrives as fresh strings in every layout, so it counts against each one
+    gc.collect()
+    tracemalloc.start()
+    histories = [build(persona, name, goal, [(role, content.encode().decode()) for role, content in messages])
+                 for persona, name, goal, messages in inputs]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    pickled = sum(len(pickle.dumps(history, protocol=pickle.HIGHEST_PROTOCOL)) for history in histories)
+    return allocated / sessions, pickled / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=10, help="user/assistant pairs per session")
+    parser.add_argument("--compress-after", type=int, default=6, help="HISTORY_COMPRESS_AFTER for the last run")
+    args = parser.parse_args()
+
+    layouts = (
+        ("dict list", dict_history),
+        ("compact", compact_history),
+        (f"compact, compress after {args.compress_after}",
+         lambda *session: compact_history(*session, compress_after=args.compress_after)),
+    )
+    print(f"{args.sessions} sessions with {args.turns} turn pairs each")
+    baseline = None
+    for label, build in layouts:
+        allocated, pickled = measure(build, args.sessions, args.turns)
+        baseline = baseline or allocated
+        print(f"{label:<28} {allocated:8.0f} B/session in memory ({allocated / baseline:4.0%})  "
+              f"{pickled:8.0f} B/session pickled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+End-to-end load test: runs the real bot (main.py) against a fake Telegram Bot API
+and a fake OpenAI endpoint, and drives thousands of simulated users through it.
+
+Every user goes through /start -> name -> goal -> /create -> persona button ->
+N messages -> /end, waiting for the bot's reply at each step. The bot runs in
+its own process with an in-memory session store, exactly as wired up in main.py.
+
+Reported:
+- updates per second handled end to end
+- p50/p95/p99 reply latency, for onboarding steps and for simulation turns
+- the bot's event loop lag, scraped from its /metrics endpoint
+- with --flood-limit, how often the fake Telegram refused a send with RetryAfter
+
+Usage:
+    python benchmarks/load_test.py --users 2000 --messages 5 --ramp 20 --latency 0.5
+    python benchmarks/load_test.py --users 1000 --bot-env LLM_REQUESTS_PER_MINUTE=0 --bot-env CONCURRENT_UPDATES=1024
+    python benchmarks/load_test.py --users 500 --flood-limit 30 --bot-env OUTBOUND_GLOBAL_RATE=0
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import httpx
+
+from fake_openai import FakeOpenAI
+from fake_telegram import FakeTelegram
+from webhook_load import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STREAM_PLACEHOLDER = "…"  # config.STREAM_PLACEHOLDER
+BOT_TOKEN = "123456:load-test"
+
+
+class StepFailed(Exception):
+    """The bot did not answer a step in time, or answered something unexpected."""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class User:
+    """One simulated user; records the latency of every reply it waits for."""
+
+    def __init__(self, chat_id, telegram, args, latencies):
+        self.chat_id = chat_id
+        self.telegram = telegram
+        self.args = args
+        self.latencies = latencies
+        self.placeholders = set()
+
+    async def _reply(self):
+        """
+        Waits for the bot's answer: the next new message, or for a streamed reply the first
+        edit that replaces the placeholder. Queue notices and later stream edits are skipped.
+        """
+        while True:
+            event = await self.telegram.next_event(self.chat_id)
+            if event.method == "sendMessage":
+                if event.text == STREAM_PLACEHOLDER:
+                    self.placeholders.add(event.message_id)
+                elif not event.text.startswith("⏳"):
+                    return event
+            elif event.message_id in self.placeholders:
+                self.placeholders.discard(event.message_id)
+                return event
+
+    async def _step(self, kind, push):
+        # Users take a moment to read and type. Answering instantly can also outrun
+        # ConversationHandler, which only records the next state once the handler returns.
+        await asyncio.sleep(self.args.think * random.uniform(0.5, 1.5))
+        start = time.perf_counter()
+        push()
+        try:
+            event = await asyncio.wait_for(self._reply(), self.args.timeout)
+        except asyncio.TimeoutError:
+            raise StepFailed(f"no reply to a {kind} step within {self.args.timeout}s") from None
+        self.latencies.setdefault(kind, []).append(event.time - start)
+        return event
+
+    def _say(self, kind, text):
+        return self._step(kind, lambda: self.telegram.push_message(self.chat_id, text))
+
+    async def run(self):
+        await self._say("onboarding", "/start")
+        await self._say("onboarding", f"User {self.chat_id}")
+        await self._say("onboarding", "to get better at pitching")
+        menu = await self._say("onboarding", "/create")
+        if not menu.reply_markup:
+            raise StepFailed(f"expected the persona menu, got {menu.text!r}")
+        buttons = [row[0]["callback_data"] for row in menu.reply_markup["inline_keyboard"]]
+        choice = random.choice(buttons)
+        await self._step("opener", lambda: self.telegram.push_callback(self.chat_id, choice, menu.message_id))
+        for i in range(self.args.messages):
+            await self._say("turn", f"Message {i + 1}: here is what I think about that, what would you say?")
+        await self._say("onboarding", "/end")
+
+
+def histogram_quantile(metrics_texts, name, q):
+    """Upper bound of the bucket containing quantile q of a Prometheus histogram, summed over scrapes."""
+    buckets = {}
+    for metrics_text in metrics_texts:
+        for line in metrics_text.splitlines():
+            if line.startswith(f"{name}_bucket"):
+                bound = float(line.split('le="')[1].split('"')[0])
+                buckets[bound] = buckets.get(bound, 0) + float(line.rsplit(" ", 1)[1])
+    if not buckets or not buckets[float("inf")]:
+        return None
+    total = buckets[float("inf")]
+    return next(bound for bound, count in sorted(buckets.items()) if count >= q * total)
+
+
+def report_lag(label, metrics_texts):
+    lags = [histogram_quantile(metrics_texts, "event_loop_lag_seconds", q) for q in (0.5, 0.99, 1.0)]
+    if lags[0] is not None:
+        print(f"{label} event loop lag: p50 <= {lags[0] * 1000:g} ms, p99 <= {lags[1] * 1000:g} ms, "
+              f"max <= {lags[2] * 1000:g} ms")
+
+
+def bot_environment(args, telegram_url, openai_url, metrics_port):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_BASE_URL": f"{telegram_url}/bot",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "OPENAI_API_KEY": "load-test",
+        "UPDATE_MODE": "polling",
+        "SESSION_BACKEND": "memory",
+        "METRICS_HOST": "127.0.0.1",
+        "METRICS_PORT": str(metrics_port),
+        "STREAM_REPLIES": "true" if args.stream else "false",
+        "SHARD_WORKERS": str(args.workers),
+    })
+    env.update(setting.split("=", 1) for setting in args.bot_env)
+    return env
+
+
+async def drive(args, telegram, metrics_port):
+    """Runs every user through the bot and scrapes its metrics afterwards."""
+    try:
+        await asyncio.wait_for(telegram.polling.wait(), 30)
+    except asyncio.TimeoutError:
+        sys.exit(f"The bot did not start polling within 30s, see {args.bot_log}")
+
+    latencies, failures = {}, []
+
+    async def run_user(chat_id):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        try:
+            await User(chat_id, telegram, args, latencies).run()
+        except StepFailed as e:
+            failures.append(str(e))
+
+    print(f"Driving {args.users} users with {args.messages} turns each over {max(args.workers, 1)} process(es) "
+          f"({'streamed' if args.stream else 'plain'} replies, model latency {args.latency}s)...")
+    pushed_before = telegram._update_id
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(100_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+    updates = telegram._update_id - pushed_before
+
+    # With workers, the front serves metrics on metrics_port and worker i on metrics_port + 1 + i
+    async with httpx.AsyncClient() as http:
+        metrics_texts = [(await http.get(f"http://127.0.0.1:{port}/metrics")).text
+                         for port in range(metrics_port, metrics_port + 1 + max(args.workers, 0))]
+
+    return updates, elapsed, latencies, failures, metrics_texts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5, help="simulation turns per user")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which users arrive")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause before each step, in seconds")
+    parser.add_argument("--workers", type=int, default=0, help="run the bot sharded over this many processes")
+    parser.add_argument("--stream", action="store_true", help="stream replies (latency is to the first text)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="give up on a step after this long")
+    parser.add_argument("--latency", type=float, default=0.5, help="model time to first token")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=100.0)
+    parser.add_argument("--reply-tokens", type=int, nargs=2, default=(20, 60), metavar=("MIN", "MAX"))
+    parser.add_argument("--flood-limit", type=int, default=0,
+                        help="refuse sends beyond this many per second with RetryAfter, as Telegram does")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra config for the bot, e.g. LLM_REQUESTS_PER_MINUTE=0")
+    parser.add_argument("--bot-log", default=os.path.join(tempfile.gettempdir(), "load_test_bot.log"))
+    args = parser.parse_args()
+
+    telegram = FakeTelegram(flood_limit=args.flood_limit)
+    fake_openai = FakeOpenAI(latency=args.latency, jitter=args.jitter, tail_rate=args.tail_rate,
+                             tail_latency=args.tail_latency, tokens_per_sec=args.tokens_per_sec,
+                             reply_tokens=tuple(args.reply_tokens))
+    telegram_server = await telegram.serve()
+    openai_server = await fake_openai.serve()
+    env = bot_environment(args, telegram_server.url, openai_server.url, free_port())
+    metrics_port = int(env["METRICS_PORT"])
+
+    with open(args.bot_log, "w") as log:
+        bot = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main.py"), cwd=ROOT, stdout=log, stderr=log, env=env,
+        )
+    try:
+        results = await drive(args, telegram, metrics_port)
+    finally:
+        # Never leave the bot running, even if the driver failed
+        if bot.returncode is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot.wait(), 15)
+            except asyncio.TimeoutError:
+                bot.kill()
+        await telegram_server.stop()
+        await openai_server.stop()
+
+    updates, elapsed, latencies, failures, metrics_texts = results
+    print(f"\n{updates} updates in {elapsed:.1f}s: {updates / elapsed:.1f} updates/s, "
+          f"{sum(map(len, latencies.values())) / elapsed:.1f} replies/s, {len(failures)} users failed")
+    for reason in sorted(set(failures))[:5]:
+        print(f"  failed: {reason}")
+    print(f"Model calls: {fake_openai.requests}")
+    if args.flood_limit:
+        print(f"Sends refused with RetryAfter: {telegram.flood_errors}")
+    for kind in ("onboarding", "opener", "turn"):
+        values = sorted(latencies.get(kind, ()))
+        if values:
+            print(f"{kind:<11} n={len(values):6d}  p50 {percentile(values, 0.5) * 1000:8.1f} ms  "
+                  f"p95 {percentile(values, 0.95) * 1000:8.1f} ms  p99 {percentile(values, 0.99) * 1000:8.1f} ms")
+    if args.workers > 1:
+        report_lag("Front", metrics_texts[:1])
+        report_lag("Workers", metrics_texts[1:])
+    else:
+        report_lag("Bot", metrics_texts[:1])
+    print(f"Bot log: {args.bot_log}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
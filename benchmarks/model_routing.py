@@ -0,0 +1,147 @@
+"""
+Measures model routing against sending every call to one model.
+
+Simulated users start a random persona and send a mix of short banter and long
+messages. The OpenAI client is an in-process transport whose latency depends on
+the model tier and on the completion length: every reply would run to --reply-tokens
+unless max_tokens cuts it short. Compared are a single standard model without a
+max_tokens limit, as before routing, and the router with the tiers from config.
+A last run makes the standard tier slow and sets a latency SLO, to show its calls
+moving to the fast tier.
+
+Usage:
+    python benchmarks/model_routing.py --users 100 --turns 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Admission limits would throttle the later runs; only the model latency should count
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "0")
+# Distinct model names, so the transport can tell the tiers apart
+os.environ.setdefault("LLM_FAST_MODEL", "bench-fast")
+os.environ.setdefault("LLM_STANDARD_MODEL", "bench-standard")
+os.environ.setdefault("LLM_DEEP_MODEL", "bench-deep")
+
+import httpx
+from openai import AsyncOpenAI
+
+import ai_service
+from ai_service import AIService, opener_pool, response_cache
+from config import MODEL_TIERS, USER_DATA_GOAL, USER_DATA_NAME, USER_DATA_PERSONA
+from model_router import ModelRouter, Route
+from persona_data import PERSONAS
+
+SHORT_MESSAGES = ("Yes.", "Haha, really?", "I don't know", "Next question please.", "Sure!")
+LONG_MESSAGE = ("Let me walk you through our whole plan in detail. " * 15).strip()
+
+
+class SingleModelRouter(ModelRouter):
+    """Every call on the standard model with no max_tokens limit, as before routing."""
+
+    def route(self, persona=None, kind="turn", user_message="", history_tokens=0):
+        settings = MODEL_TIERS["standard"]
+        return Route("standard", settings["model"], 4096, settings["temperature"], "persona")
+
+
+def make_client(base_latency, token_latency, reply_tokens):
+    """Builds a client whose completions take the model's base latency plus `token_latency` per token."""
+    async def handler(request):
+        body = json.loads(request.content)
+        tokens = min(reply_tokens, body.get("max_tokens") or reply_tokens)
+        await asyncio.sleep(base_latency[body["model"]] + tokens * token_latency)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "length" if tokens < reply_tokens else "stop",
+                "message": {"role": "assistant", "content": " ".join(["word"] * tokens)},
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens},
+        })
+
+    return AsyncOpenAI(
+        base_url="http://benchmark.local/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+async def run_user(rng, turns, latencies, tokens):
+    user_data = {USER_DATA_NAME: "Alex", USER_DATA_GOAL: "to feel more confident",
+                 USER_DATA_PERSONA: rng.choice(list(PERSONAS))}
+    service = AIService(user_data)
+    await service.set_persona(user_data[USER_DATA_PERSONA], user_data[USER_DATA_NAME], user_data[USER_DATA_GOAL])
+    messages = [LONG_MESSAGE if rng.random() < 0.25 else rng.choice(SHORT_MESSAGES) for _ in range(turns)]
+    for message in messages:
+        start = time.perf_counter()
+        reply = await service.get_response(message)
+        latencies.append(time.perf_counter() - start)
+        tokens.append(len(reply.split()))
+
+
+async def run(label, router, users, turns):
+    """Runs all users at once on `router` and prints turn latency, reply length and the routing mix."""
+    ai_service.model_router = router
+    rng = random.Random(1)
+    latencies, tokens = [], []
+    await asyncio.gather(*(run_user(rng, turns, latencies, tokens) for _ in range(users)))
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    tiers = Counter(route for route in router.decisions)
+    mix = ", ".join(f"{tier}/{reason} {count}" for (tier, reason), count in sorted(tiers.items()))
+    print(f"{label:<22} mean turn {statistics.mean(latencies) * 1000:6.0f} ms  p95 {p95 * 1000:6.0f} ms  "
+          f"mean reply {statistics.mean(tokens):5.0f} tokens")
+    print(f"{'':<22} calls: {mix}")
+
+
+def recording(router):
+    """Wraps `router` so the benchmark can count its decisions."""
+    router.decisions = []
+    record = router.record
+
+    def record_decision(route, persona_name=None):
+        router.decisions.append((route.tier, route.reason))
+        record(route, persona_name)
+
+    router.record = record_decision
+    return router
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=4, help="messages per user after the opener")
+    parser.add_argument("--reply-tokens", type=int, default=400, help="reply length without a max_tokens limit")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds per completion token")
+    args = parser.parse_args()
+
+    # Every turn makes a model call, so all runs are comparable
+    opener_pool.pool_size = 0
+    response_cache.max_entries = 0
+    models = {tier: settings["model"] for tier, settings in MODEL_TIERS.items()}
+    base_latency = {models["fast"]: 0.1, models["standard"]: 0.3, models["deep"]: 0.6}
+    ai_service.client = make_client(base_latency, args.token_latency, args.reply_tokens)
+
+    print(f"{args.users} users, {args.turns} turns each, replies of up to {args.reply_tokens} tokens")
+    await run("single model", recording(SingleModelRouter(slo=0)), args.users, args.turns)
+    await run("routed", recording(ModelRouter(slo=0)), args.users, args.turns)
+
+    # The standard tier slows down; with a 1s SLO its calls should move to the fast tier
+    base_latency[models["standard"]] = 1.5
+    await run("routed, slow standard", recording(ModelRouter(slo=1.0, window=20, min_samples=10, cooldown=600)),
+              args.users, args.turns)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Measures how long set_persona takes with and without the opener pool.
+
+Uses the same simulated model latency as concurrent_chats.py. The pool is warmed
+first, then each persona is started several times; the pool's hit/miss counters
+show how many starts skipped the model call.
+
+Usage:
+    python benchmarks/opener_pool.py --latency 0.5 --starts 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import ai_service
+from ai_service import AIService, opener_pool
+from concurrent_chats import make_client
+from persona_data import PERSONAS
+
+
+async def time_starts(starts):
+    """Starts `starts` simulations one after another and returns the mean latency."""
+    personas = list(PERSONAS)
+    elapsed = 0.0
+    for i in range(starts):
+        start = time.perf_counter()
+        await AIService({}).set_persona(personas[i % len(personas)], "Alex", "to get better at small talk")
+        elapsed += time.perf_counter() - start
+        # Give background refills a moment, as real users arrive spread out over time
+        await asyncio.sleep(0.05)
+    return elapsed / starts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated model latency in seconds")
+    parser.add_argument("--starts", type=int, default=20, help="simulations started per run")
+    args = parser.parse_args()
+
+    ai_service.client = make_client(args.latency)
+
+    pool_size = opener_pool.pool_size
+    opener_pool.pool_size = 0
+    live = await time_starts(args.starts)
+
+    opener_pool.pool_size = pool_size
+    opener_pool.warm()
+    await asyncio.sleep(args.latency * (pool_size + 1))
+    pooled = await time_starts(args.starts)
+
+    stats = opener_pool.stats()
+    print(f"model latency:        {args.latency:.3f}s")
+    print(f"live set_persona:     {live * 1000:.1f} ms")
+    print(f"pooled set_persona:   {pooled * 1000:.1f} ms (pool size {pool_size})")
+    print(f"hits/misses:          {stats['hits']}/{stats['misses']} ({stats['hit_rate']:.0%} hit rate)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
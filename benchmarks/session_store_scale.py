@@ -0,0 +1,99 @@
+"""
+Measures resident memory and message throughput of the session store.
+
+Synthetic users each get a profile, an active persona and a short conversation.
+Messages are then delivered to random users, every one of them going through
+SessionStore.get() exactly as the handlers do via context.user_data, with the
+write-behind flusher running in the background.
+
+Usage:
+    python benchmarks/session_store_scale.py --users 100000 --messages 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_PERSONA, USER_DATA_HISTORY
+from history import ASSISTANT, USER, PromptTurn, Turn
+from persona_data import PERSONAS
+from session_store import SessionStore, create_session_backend
+
+
+def rss_mib():
+    """Returns the current resident set size in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def deliver(store, user_id, text):
+    """Applies one synthetic turn to the user's session."""
+    session = store.get(user_id)
+    if USER_DATA_NAME not in session:
+        persona = random.choice(list(PERSONAS))
+        session[USER_DATA_NAME] = f"user{user_id}"
+        session[USER_DATA_GOAL] = "to practice social skills"
+        session[USER_DATA_PERSONA] = persona
+        session[USER_DATA_HISTORY] = [PromptTurn(persona, session[USER_DATA_NAME], session[USER_DATA_GOAL])]
+    history = session[USER_DATA_HISTORY]
+    history.append(Turn(USER, text))
+    history.append(Turn(ASSISTANT, "That's interesting, tell me more about it."))
+
+
+async def run(args, path):
+    store = SessionStore(create_session_backend(args.backend, path), cache_size=args.cache_size)
+    store.start()
+    baseline = rss_mib()
+
+    start = time.perf_counter()
+    for user_id in range(args.users):
+        deliver(store, user_id, "Hi there!")
+        if user_id % 1000 == 0:
+            await asyncio.sleep(0)  # let the flusher run, as the event loop would between updates
+    onboard_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        deliver(store, random.randrange(args.users), "Here is what I think about that.")
+        if i % 1000 == 0:
+            await asyncio.sleep(0)
+    message_elapsed = time.perf_counter() - start
+    resident = rss_mib()
+
+    await store.stop()
+
+    print(f"backend:            {args.backend}")
+    print(f"users:              {args.users}")
+    print(f"cache size:         {args.cache_size}")
+    print(f"onboarding:         {args.users / onboard_elapsed:,.0f} sessions/s")
+    print(f"messages:           {args.messages / message_elapsed:,.0f} msg/s")
+    print(f"reloads/evictions:  {store.loads:,} / {store.evictions:,}")
+    print(f"flush batches:      {store.flushes:,}")
+    print(f"resident memory:    {resident:.1f} MiB ({resident - baseline:+.1f} MiB while running)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--cache-size", type=int, default=10_000)
+    parser.add_argument("--backend", choices=("sqlite", "memory"), default="sqlite")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, os.path.join(tmp, "sessions.db")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Runs AIService against the fake OpenAI endpoint with injected slow tails and failures.
+
+Three scenarios are compared:
+- no resilience: single attempt, no hedging
+- retries: deadlines and jittered retries for retryable errors
+- retries + hedging: a second attempt fires once the first passes the recent p95
+A final scenario takes the provider down entirely to show the circuit breaker
+failing calls fast.
+
+Usage:
+    python benchmarks/tail_latency.py --calls 400 --tail-rate 0.05 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import httpx
+from openai import AsyncOpenAI
+
+import ai_service
+from ai_service import AIService
+from admission import LLMScheduler
+from fake_openai import FakeOpenAI
+from resilience import CircuitBreaker, ResilientCaller
+from webhook_load import percentile
+
+FALLBACKS = ("Sorry", "⚠️", "⏳")
+
+
+async def run_scenario(name, caller, args):
+    ai_service.resilient_caller = caller
+    latencies, failed = [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one_call():
+        nonlocal failed
+        async with semaphore:
+            start = time.perf_counter()
+            reply = await AIService({}).get_response("How would you answer that?")
+            latencies.append(time.perf_counter() - start)
+            failed += reply.startswith(FALLBACKS)
+
+    await asyncio.gather(*(one_call() for _ in range(args.calls)))
+    latencies.sort()
+    stats = caller.stats()
+    print(f"{name:<20} p50 {percentile(latencies, 0.5):6.2f}s  p95 {percentile(latencies, 0.95):6.2f}s  "
+          f"p99 {percentile(latencies, 0.99):6.2f}s  failed {failed:4d}  retries {stats['retries']:4d}  "
+          f"hedges {stats['hedges']:4d} (won {stats['hedge_wins']})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=3.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                      error_rate=args.error_rate, tokens_per_sec=1000)
+    server = await fake.serve()
+    ai_service.client = AsyncOpenAI(base_url=f"{server.url}/v1", max_retries=0,
+                                    http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=200)))
+    # Keep admission control out of the way; this measures the provider side only
+    ai_service.llm_scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0)
+    breaker_off = dict(failure_threshold=10**9, cooldown=0)
+
+    await run_scenario("no resilience", ResilientCaller(
+        max_attempts=1, hedging=False, breaker=CircuitBreaker(**breaker_off)), args)
+    await run_scenario("retries", ResilientCaller(
+        hedging=False, breaker=CircuitBreaker(**breaker_off)), args)
+    await run_scenario("retries + hedging", ResilientCaller(
+        hedging=True, hedge_min_samples=20, breaker=CircuitBreaker(**breaker_off)), args)
+
+    fake.error_rate = 1.0
+    breaker = CircuitBreaker(failure_threshold=5, cooldown=30)
+    await run_scenario("provider down", ResilientCaller(breaker=breaker), args)
+    print(f"breaker state after outage: {breaker.state}; requests that reached the provider: "
+          f"{fake.failures_injected}")
+
+    await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
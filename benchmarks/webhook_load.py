@@ -0,0 +1,85 @@
+"""
+Load generator for the webhook endpoint.
+
+POSTs synthetic Telegram Update JSON to a bot running with UPDATE_MODE=webhook and
+reports requests per second and latency percentiles. It measures ingestion only:
+the webhook answers as soon as an update is queued, so handler work (and any
+Telegram API calls it makes) doesn't count towards the latency.
+
+Usage:
+    UPDATE_MODE=webhook WEBHOOK_URL=https://example.com/telegram WEBHOOK_SECRET_TOKEN=s3cret python main.py
+    python benchmarks/webhook_load.py --url http://127.0.0.1:8443/telegram --secret s3cret
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at `fraction` (0-1) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def synthetic_update(update_id, users):
+    """Builds a text message Update from one of `users` synthetic users."""
+    user_id = 1_000_000 + update_id % users
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": f"Synthetic message {update_id}",
+        },
+    }
+
+
+async def worker(client, args, update_ids, latencies, statuses):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    for update_id in update_ids:
+        if update_id > args.requests:
+            return
+        start = time.perf_counter()
+        try:
+            response = await client.post(args.url, json=synthetic_update(update_id, args.users), headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+        latencies.append(time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None, help="value for X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000, help="distinct synthetic users")
+    args = parser.parse_args()
+
+    latencies, statuses = [], {}
+    update_ids = itertools.count(1)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, args, update_ids, latencies, statuses) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"requests:    {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f} req/s)")
+    print(f"statuses:    {statuses}")
+    print(f"latency p50: {percentile(latencies, 0.50) * 1000:.1f} ms")
+    print(f"latency p95: {percentile(latencies, 0.95) * 1000:.1f} ms")
+    print(f"latency p99: {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,6 +3,22 @@ import os
 # --- Telegram Bot Configuration ---
 # The bot token must be set as an environment variable
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+# Bot API endpoint, with the token appended. Leave unset for api.telegram.org; point it at a
+# local Bot API server or at benchmarks/fake_telegram.py (e.g. http://127.0.0.1:8082/bot).
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL")
+
+# --- Update Ingestion ---
+# "polling" fetches updates with getUpdates; "webhook" runs an embedded HTTP server that
+# Telegram pushes updates to. Webhook mode needs WEBHOOK_URL to be a public HTTPS URL that
+# reaches WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH (usually through a reverse proxy).
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+# Telegram sends this in the X-Telegram-Bot-Api-Secret-Token header; other requests are rejected
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "100"))
 
 # --- AI Configuration ---
 # Using the pre-configured OPENAI_API_KEY and custom base URL for Gemini 2.5 Flash
@@ -10,6 +26,173 @@ GEMINI_API_KEY = os.environ.get("OPENAI_API_KEY")
 GEMINI_BASE_URL = "https://api.gemini.com/v1" # Placeholder, will use the pre-configured OpenAI client which is set up for Gemini.
 # The actual model name for Gemini 2.5 Flash
 GEMINI_MODEL = "gemini-2.5-flash"
+LLM_TEMPERATURE = 0.7
+
+# --- Model Routing ---
+# Model tiers from fastest to most capable, each with its own generation limits. Personas
+# choose a tier with "model_tier" in their persona file (default MODEL_DEFAULT_TIER), and
+# may override "temperature" and cap "max_tokens". Every tier uses GEMINI_MODEL unless
+# its model is set.
+MODEL_TIERS = {
+    "fast": {"model": os.environ.get("LLM_FAST_MODEL", GEMINI_MODEL), "max_tokens": 256, "temperature": 0.8},
+    "standard": {"model": os.environ.get("LLM_STANDARD_MODEL", GEMINI_MODEL), "max_tokens": 512,
+                 "temperature": LLM_TEMPERATURE},
+    "deep": {"model": os.environ.get("LLM_DEEP_MODEL", GEMINI_MODEL), "max_tokens": 1024, "temperature": 0.6},
+}
+MODEL_DEFAULT_TIER = "standard"
+# A turn moves one tier down for a short message early in a conversation, and one tier up
+# for a long message or a long history. Summaries always use the fastest tier.
+ROUTE_SHORT_MESSAGE_CHARS = 40
+ROUTE_LONG_MESSAGE_CHARS = 600
+ROUTE_SMALL_HISTORY_TOKENS = 1000
+ROUTE_LARGE_HISTORY_TOKENS = 4000
+# Latency SLO: once the p95 time to a reply (or its first streamed text), admission wait
+# included, of a tier's recent calls exceeds the SLO, its traffic moves to the next faster
+# tier for the cooldown period.
+ROUTE_LATENCY_SLO = float(os.environ.get("ROUTE_LATENCY_SLO", "10"))  # seconds
+ROUTE_SLO_WINDOW = 50  # recent calls per tier that the p95 is taken over
+ROUTE_SLO_MIN_SAMPLES = 20
+ROUTE_DEGRADE_COOLDOWN = float(os.environ.get("ROUTE_DEGRADE_COOLDOWN", "60"))  # seconds
+
+# --- Personas ---
+# One JSON (or YAML) file per persona, listed in the selection menu in file name order.
+# Edits are picked up every PERSONA_RELOAD_INTERVAL seconds without a restart; set it
+# to 0 to only load the personas at startup.
+PERSONA_DIR = os.environ.get("PERSONA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "personas"))
+PERSONA_RELOAD_INTERVAL = float(os.environ.get("PERSONA_RELOAD_INTERVAL", "2"))  # seconds
+
+# --- AI HTTP Client Configuration ---
+# One async client with a shared connection pool serves every chat. Keep-alive
+# connections stay open between turns so concurrent users reuse warm sockets.
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))  # seconds
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))  # seconds
+LLM_REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", "60"))  # seconds
+
+# --- AI Admission Control ---
+# Budgets shared by every model call. Waiting calls are served round-robin across
+# sessions, with simulation openers first. Set a budget to 0 to disable it. In sharded
+# mode the budgets and queue depth are split evenly between the workers.
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_MAX_QUEUE_DEPTH = int(os.environ.get("LLM_MAX_QUEUE_DEPTH", "500"))  # calls beyond this are shed
+LLM_QUEUE_NOTIFY_DEPTH = int(os.environ.get("LLM_QUEUE_NOTIFY_DEPTH", "20"))  # tell users queued past this
+LLM_EXPECTED_COMPLETION_TOKENS = 300  # completion size assumed when budgeting a call
+
+# --- AI Call Resilience ---
+# Deadlines and retries for model calls. Only timeouts, connection errors, 429s and 5xx
+# responses are retried, with exponential backoff and full jitter.
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("LLM_ATTEMPT_TIMEOUT", "20"))  # seconds per attempt
+LLM_CALL_DEADLINE = float(os.environ.get("LLM_CALL_DEADLINE", "45"))  # seconds for all attempts together
+LLM_BACKOFF_BASE = 0.5  # seconds; doubles with every retry
+LLM_BACKOFF_MAX = 8.0  # seconds
+# Hedging: if an attempt hasn't finished by the recent p95 latency, send a second one
+# and use whichever answers first. Costs extra requests on slow calls only.
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20  # latency samples needed before hedging kicks in
+# Circuit breaker: after this many consecutive failures, fail fast for the cooldown period
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))  # seconds
+
+# --- Streaming Replies ---
+# When enabled, replies are streamed from the model and a placeholder Telegram message is
+# edited as text arrives. Edits are throttled to stay well inside Telegram's edit limits.
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "true").lower() == "true"
+STREAM_PLACEHOLDER = "…"
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))  # min seconds between edits
+STREAM_EDIT_MIN_CHARS = int(os.environ.get("STREAM_EDIT_MIN_CHARS", "40"))  # min new characters per edit
+
+# --- Outbound Messages ---
+# Every Bot API call that targets a chat passes through a rate limiter that keeps the bot
+# inside Telegram's flood limits: about 30 messages per second overall, one per second in
+# a private chat and 20 per minute in a group. A RetryAfter from Telegram pauses all sends
+# for the requested time before the call is retried. With sharding, each worker gets an
+# equal share of the global rate. Set OUTBOUND_GLOBAL_RATE to 0 to only react to RetryAfter.
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))  # messages per second
+OUTBOUND_CHAT_RATE = 1.0  # messages per second in a private chat
+OUTBOUND_GROUP_RATE = 20 / 60  # messages per second in a group chat
+OUTBOUND_CHAT_BURST = 3  # messages a chat can get at once before its rate applies
+OUTBOUND_CHAT_BUCKETS = 10000  # per-chat limiter state kept for the most recently active chats
+OUTBOUND_MAX_RETRIES = 3  # RetryAfter retries before a send fails
+TELEGRAM_MESSAGE_LIMIT = 4096  # longer replies are split into several messages
+# While a reply is being generated, a "typing…" indicator is shown after this delay and
+# refreshed every interval. It is skipped when the chat has no send budget to spare.
+TYPING_INDICATOR_DELAY = 0.5  # seconds
+TYPING_INDICATOR_INTERVAL = 4.5  # seconds; Telegram shows the indicator for 5
+
+# --- Opener Pool ---
+# Number of pre-generated opening messages kept per persona, so starting a simulation
+# doesn't wait for a model call. Set to 0 to always generate openers live.
+OPENER_POOL_SIZE = int(os.environ.get("OPENER_POOL_SIZE", "3"))
+
+# --- Response Cache ---
+# Personas with "cache_responses" set share replies for identical early conversations
+# (same persona, same messages, ignoring the user's name and goal). Set the size to 0 to
+# disable; set RESPONSE_CACHE_DB_PATH to keep entries on disk across restarts.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "5000"))  # entries kept in memory
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "86400"))  # seconds
+RESPONSE_CACHE_MAX_MESSAGES = 6  # conversations longer than this are never looked up
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH")
+
+# --- Conversation History Window ---
+# Once the history sent to the model grows past the token budget, the oldest turns are
+# folded into a running summary. Personas can override the budget with a
+# "history_token_budget" entry in their persona file.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_TRIM_RATIO = 0.75  # fold until the history is back under this fraction of the budget
+HISTORY_MIN_RECENT_MESSAGES = 6  # the most recent messages are always sent verbatim
+HISTORY_SUMMARY_MAX_WORDS = 250
+HISTORY_CHARS_PER_TOKEN = 4  # rough estimate used for token accounting
+HISTORY_MESSAGE_TOKEN_OVERHEAD = 4  # per-message formatting cost
+# Turns this far from the end of the history are kept zlib-compressed in memory and
+# decompressed when sent. Set to 0 to keep every turn as plain text.
+HISTORY_COMPRESS_AFTER = int(os.environ.get("HISTORY_COMPRESS_AFTER", "0"))
+HISTORY_COMPRESS_MIN_CHARS = 256  # shorter turns don't compress well enough to bother
+
+# --- Session Persistence ---
+# User sessions are persisted so simulations survive restarts. Only the most recently
+# active sessions stay in memory; the rest are reloaded from the backend on demand.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")  # "sqlite" or "memory"
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))  # sessions kept in memory
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "2.0"))  # seconds between flushes
+SESSION_FLUSH_BATCH_SIZE = 500  # flush early once this many sessions are pending
+
+# --- Turn Scheduling ---
+# Messages a user sends within this many seconds of each other (or while their previous
+# turn is still running) are merged into a single model call.
+TURN_DEBOUNCE_SECONDS = float(os.environ.get("TURN_DEBOUNCE_SECONDS", "0.4"))
+
+# --- Metrics ---
+# Prometheus metrics are served at http://METRICS_HOST:METRICS_PORT/metrics. The same server
+# exposes /debug/profile/start and /debug/profile/stop for the event loop sampling profiler.
+# Set METRICS_PORT to 0 to disable.
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# How often the event loop lag monitor wakes up while metrics are served
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL", "0.1"))  # seconds
+
+# --- Update Processing ---
+# Number of Telegram updates processed concurrently. Without this, python-telegram-bot
+# handles updates one at a time and a single slow model call stalls every other chat.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "256"))
+
+# --- Sharding ---
+# With SHARD_WORKERS > 1, main.py starts a front process that receives updates and routes
+# each user, by consistent hashing of their id, to one of SHARD_WORKERS worker processes.
+# Workers share the session database and serve metrics on METRICS_PORT + 1 + worker index.
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "0"))
+SHARD_VIRTUAL_NODES = 64  # points per worker on the hash ring
+SHARD_SUPERVISE_INTERVAL = 1.0  # seconds between worker liveness checks
+SHARD_STOP_TIMEOUT = 30.0  # seconds a worker gets to finish its in-flight updates on shutdown
+
+# --- Batch Runner ---
+# batch_runner.py replays scripted conversations against the personas without Telegram
+BATCH_PARALLELISM = int(os.environ.get("BATCH_PARALLELISM", "8"))  # conversations run at once
+BATCH_OUTPUT_PATH = os.environ.get("BATCH_OUTPUT_PATH", "batch_results.jsonl")
 
 # --- Conversation States for ConversationHandler ---
 # Used in the /start command for user onboarding
@@ -23,3 +206,11 @@ USER_DATA_NAME = "user_name"
 USER_DATA_GOAL = "user_goal"
 USER_DATA_PERSONA = "active_persona"
 USER_DATA_HISTORY = "conversation_history"
+USER_DATA_HISTORY_TOKENS = "history_token_ledger"
+USER_DATA_HISTORY_SUMMARY = "history_summary"
+
+# Keys written to the session store; anything else in user_data is transient.
+PERSISTED_USER_DATA_KEYS = (
+    USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_PERSONA,
+    USER_DATA_HISTORY, USER_DATA_HISTORY_TOKENS, USER_DATA_HISTORY_SUMMARY,
+)
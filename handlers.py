@@ -1,14 +1,44 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import logging
+import time
+from telegram import Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
-from config import NAME, GOAL, SELECT_PERSONA, USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_PERSONA
+from telegram.helpers import escape_markdown
+from config import (
+    NAME, GOAL, SELECT_PERSONA, USER_DATA_NAME, USER_DATA_GOAL, USER_DATA_PERSONA,
+    STREAM_REPLIES, STREAM_PLACEHOLDER, STREAM_EDIT_INTERVAL, STREAM_EDIT_MIN_CHARS, TELEGRAM_MESSAGE_LIMIT
+)
 from persona_data import PERSONAS, get_persona_keyboard
 from ai_service import AIService
+from metrics import instrument_handler
+from outbound import reply_text, split_message, typing_indicator
+from turn_scheduler import TurnScheduler
+
+logger = logging.getLogger(__name__)
+
+# Serializes model turns per conversation and merges rapid-fire messages
+turn_scheduler = TurnScheduler()
 
 # --- Helper Functions ---
 
-def get_ai_service(context: ContextTypes.DEFAULT_TYPE):
-    """Initializes and returns the AIService instance."""
-    return AIService(context.user_data)
+def get_ai_service(context: ContextTypes.DEFAULT_TYPE, message: Message | None = None):
+    """
+    Initializes and returns the AIService instance. If `message` is given, the user is
+    told their queue position there when the model is busy.
+    """
+    async def notify_queued(position: int) -> None:
+        try:
+            await message.reply_text(
+                f"⏳ It's busy right now, you're queued at position {position}. I'll reply as soon as it's your turn."
+            )
+        except TelegramError as e:
+            logger.warning("Could not send queue position: %s", e)
+
+    return AIService(context.user_data, on_queued=notify_queued if message is not None else None)
+
+def get_turn_key(update: Update) -> tuple:
+    """Identifies the conversation whose turns must not interleave."""
+    return update.effective_chat.id, update.effective_user.id
 
 def is_simulation_active(context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Checks if a simulation is currently active."""
@@ -20,8 +50,50 @@ def get_user_info(context: ContextTypes.DEFAULT_TYPE) -> tuple[str, str]:
     goal = context.user_data.get(USER_DATA_GOAL, "to practice social skills")
     return name, goal
 
+async def send_streamed_reply(message: Message, replies) -> None:
+    """
+    Replies to `message` with a placeholder and edits it as the streamed reply grows.
+
+    Edits are throttled to at most one every STREAM_EDIT_INTERVAL seconds and only once
+    at least STREAM_EDIT_MIN_CHARS new characters have arrived. The final text is always
+    written once the stream ends; if it is too long for one message, the placeholder gets
+    the first part and the rest follows in new messages. If that final edit fails, the
+    first part is sent as a new message instead.
+    """
+    placeholder = await message.reply_text(STREAM_PLACEHOLDER)
+    shown_text = STREAM_PLACEHOLDER
+    last_edit = time.monotonic()
+    text = None
+
+    async for text in replies:
+        now = time.monotonic()
+        if (now - last_edit < STREAM_EDIT_INTERVAL or len(text) - len(shown_text) < STREAM_EDIT_MIN_CHARS
+                or len(text) > TELEGRAM_MESSAGE_LIMIT):
+            continue
+        try:
+            await placeholder.edit_text(text)
+            shown_text = text
+        except TelegramError as e:
+            # A skipped intermediate edit is harmless; the final edit carries the full text.
+            logger.warning("Skipping streamed edit: %s", e)
+        last_edit = now
+
+    if not text:
+        return
+    first, *rest = split_message(text)
+    if first != shown_text:
+        try:
+            await placeholder.edit_text(first)
+        except TelegramError as e:
+            # The reply is already in the history, so it must reach the user some other way
+            logger.warning("Final streamed edit failed, sending the reply as a new message: %s", e)
+            await reply_text(message, first)
+    for chunk in rest:
+        await reply_text(message, chunk)
+
 # --- Command Handlers ---
 
+@instrument_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the user onboarding conversation."""
     if USER_DATA_NAME in context.user_data:
@@ -37,6 +109,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     )
     return NAME
 
+@instrument_handler
 async def start_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Stores the user's name and asks for their goal."""
     user_name = update.message.text.strip()
@@ -47,6 +120,7 @@ async def start_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return GOAL
 
+@instrument_handler
 async def start_get_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Stores the user's goal and ends the onboarding."""
     user_goal = update.message.text.strip()
@@ -58,6 +132,7 @@ async def start_get_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return ConversationHandler.END
 
+@instrument_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays a list of all available commands."""
     help_text = (
@@ -71,6 +146,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+@instrument_handler
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Provides information about the bot's concept."""
     about_text = (
@@ -84,22 +160,27 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     )
     await update.message.reply_text(about_text, parse_mode='Markdown')
 
+@instrument_handler
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays current user settings."""
     name, goal = get_user_info(context)
     settings_text = (
         "⚙️ **Your Current Settings**\n\n"
-        f"**Name:** {name}\n"
-        f"**Goal:** {goal}\n\n"
+        f"**Name:** {escape_markdown(name)}\n"
+        f"**Goal:** {escape_markdown(goal)}\n\n"
         "To change these, you would need to reset your user data (feature coming soon)."
     )
     await update.message.reply_text(settings_text, parse_mode='Markdown')
 
+@instrument_handler
 async def end_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Ends the current simulation and resets the state."""
-    if is_simulation_active(context):
-        persona = context.user_data.pop(USER_DATA_PERSONA)
-        get_ai_service(context).reset_history()
+    async with turn_scheduler.exclusive(get_turn_key(update)):
+        persona = context.user_data.pop(USER_DATA_PERSONA, None)
+        if persona is not None:
+            get_ai_service(context).reset_history()
+
+    if persona is not None:
         await update.message.reply_text(
             f"🛑 Simulation with **{persona}** ended. "
             "Your conversation history has been cleared. Use /create to start a new one!",
@@ -110,6 +191,7 @@ async def end_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 # --- Persona Selection Handlers ---
 
+@instrument_handler
 async def create_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the persona selection process."""
     if not USER_DATA_NAME in context.user_data:
@@ -126,10 +208,12 @@ async def create_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return SELECT_PERSONA
 
+@instrument_handler
 async def investor_pitch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Shortcut for the Investor persona."""
     await start_simulation(update, context, "Investor")
 
+@instrument_handler
 async def select_persona_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the inline button press for persona selection."""
     query = update.callback_query
@@ -146,6 +230,11 @@ async def select_persona_callback(update: Update, context: ContextTypes.DEFAULT_
 
 async def start_simulation(update: Update, context: ContextTypes.DEFAULT_TYPE, persona_name: str) -> None:
     """Common function to start any simulation."""
+    # Run as a turn of its own so it can't interleave with a pending message turn
+    async with turn_scheduler.exclusive(get_turn_key(update)):
+        await _start_simulation(update, context, persona_name)
+
+async def _start_simulation(update: Update, context: ContextTypes.DEFAULT_TYPE, persona_name: str) -> None:
     # Check if a simulation is already active
     if is_simulation_active(context):
         await update.effective_message.reply_text(
@@ -155,6 +244,13 @@ async def start_simulation(update: Update, context: ContextTypes.DEFAULT_TYPE, p
         )
         return
 
+    # A menu sent before the personas were reloaded may offer one that no longer exists
+    if persona_name not in PERSONAS:
+        await update.effective_message.reply_text(
+            "That persona is no longer available. Use /create to pick another one."
+        )
+        return
+
     # Store the active persona
     context.user_data[USER_DATA_PERSONA] = persona_name
 
@@ -162,11 +258,14 @@ async def start_simulation(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     name, goal = get_user_info(context)
 
     # Initialize AI service and get the first response
-    ai_service = get_ai_service(context)
-    first_response = ai_service.set_persona(persona_name, name, goal)
-
-    # Send confirmation and the AI's first message
-    await update.effective_message.reply_text(
+    ai_service = get_ai_service(context, update.effective_message)
+    async with typing_indicator(update.effective_message):
+        first_response = await ai_service.set_persona(persona_name, name, goal)
+
+    # Send confirmation and the AI's first message. Model output may not be valid
+    # Markdown; reply_text() falls back to plain text rather than losing it.
+    await reply_text(
+        update.effective_message,
         f"✅ Simulation started with **{persona_name}**!\n\n"
         f"**{persona_name}:** {first_response}",
         parse_mode='Markdown'
@@ -174,6 +273,7 @@ async def start_simulation(update: Update, context: ContextTypes.DEFAULT_TYPE, p
 
 # --- Message Handler (The main simulation loop) ---
 
+@instrument_handler
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles all non-command messages during an active simulation."""
     if not is_simulation_active(context):
@@ -182,15 +282,33 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
 
-    user_message = update.message.text
-    ai_service = get_ai_service(context)
+    # Queue the message; bursts are merged and answered by a single turn
+    await turn_scheduler.submit(
+        get_turn_key(update), update.message, lambda messages: run_turn(messages, context)
+    )
+
+async def run_turn(messages: list[Message], context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answers a burst of user messages with one model call, replying to the latest message."""
+    # The simulation may have been ended while the messages were queued
+    if not is_simulation_active(context):
+        return
+
+    user_message = "\n".join(message.text for message in messages)
+    ai_service = get_ai_service(context, messages[-1])
+
+    if STREAM_REPLIES:
+        # Stream the AI response into a progressively edited message
+        await send_streamed_reply(messages[-1], ai_service.stream_response(user_message))
+        return
 
     # Get response from AI
-    ai_response = ai_service.get_response(user_message)
+    async with typing_indicator(messages[-1]):
+        ai_response = await ai_service.get_response(user_message)
 
     # Send AI response
-    await update.message.reply_text(ai_response)
+    await reply_text(messages[-1], ai_response)
 
+@instrument_handler
 async def fallback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Fallback for when the user is in a conversation state but sends an unexpected message."""
     await update.message.reply_text("I didn't quite catch that. Please provide a simple text response.")
@@ -0,0 +1,181 @@
+"""
+Compact conversation history, token accounting and rolling summarization helpers.
+
+The history stored in user_data is a list of slotted turn records rather than
+OpenAI-style dicts. The first turn is always the persona prompt from set_persona,
+held as a reference to the shared persona template plus the user's name and goal;
+when older turns have been folded away, the second turn is the running summary of
+those turns. Turns that have gone cold can be kept zlib-compressed. The list is
+turned into OpenAI `messages` only when a model call is made, with to_messages().
+"""
+import sys
+import zlib
+from config import (
+    HISTORY_MESSAGE_TOKEN_OVERHEAD, HISTORY_CHARS_PER_TOKEN, HISTORY_COMPRESS_AFTER, HISTORY_COMPRESS_MIN_CHARS
+)
+from persona_data import PERSONAS
+
+USER = "user"
+ASSISTANT = "assistant"
+
+SUMMARY_PREFIX = "Summary of the earlier conversation (older messages were condensed):\n"
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a role-play conversation between a user and an AI persona. "
+    "Update the summary below with the new messages. Keep every fact, name, number, commitment and "
+    "open question that matters for continuing the conversation in character. Drop small talk. "
+    "Reply with the updated summary only, in at most {max_words} words.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{transcript}"
+)
+
+
+def estimate_tokens(content):
+    """Estimates the number of prompt tokens a single message with this content costs."""
+    return HISTORY_MESSAGE_TOKEN_OVERHEAD + len(content) // HISTORY_CHARS_PER_TOKEN + 1
+
+
+class Turn:
+    """
+    One message of the conversation. Roles are interned, so every turn shares the same
+    two strings, and the content of a cold turn can be held zlib-compressed.
+    """
+
+    __slots__ = ("role", "_text", "_packed")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self._text = content
+        self._packed = None
+
+    @property
+    def content(self):
+        if self._text is None:
+            return zlib.decompress(self._packed).decode()
+        return self._text
+
+    def compress(self):
+        """Compresses the content if it is long enough for that to pay off."""
+        if self._text is None or len(self._text) < HISTORY_COMPRESS_MIN_CHARS:
+            return
+        data = self._text.encode()
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            self._packed = packed
+            self._text = None
+
+    def __getstate__(self):
+        return self.role, self._text, self._packed
+
+    def __setstate__(self, state):
+        role, self._text, self._packed = state
+        self.role = sys.intern(role)
+
+
+class PromptTurn:
+    """
+    The persona prompt that opens every history: a reference to the persona's shared
+    template plus this user's name and goal, formatted only when it is sent.
+    """
+
+    __slots__ = ("persona", "user_name", "user_goal")
+
+    role = USER
+
+    def __init__(self, persona, user_name, user_goal):
+        self.persona = persona
+        self.user_name = user_name
+        self.user_goal = user_goal
+
+    @property
+    def content(self):
+        # resolve() still finds a persona that was removed after this session started it
+        return PERSONAS.resolve(self.persona).render(self.user_name, self.user_goal)
+
+    def compress(self):
+        pass
+
+    def __getstate__(self):
+        return self.persona, self.user_name, self.user_goal
+
+    def __setstate__(self, state):
+        self.persona, self.user_name, self.user_goal = state
+
+
+def to_messages(history):
+    """Builds the OpenAI `messages` list for a model call from the history."""
+    return [{"role": turn.role, "content": turn.content} for turn in history]
+
+
+def compress_cold_turns(history, appended=2, keep_recent=HISTORY_COMPRESS_AFTER):
+    """
+    Compresses the turns that just moved more than `keep_recent` turns away from the end
+    of the history because `appended` turns were added (a user message and its reply).
+    Called after every exchange, this keeps every older turn compressed. A `keep_recent`
+    of 0 disables compression.
+    """
+    if keep_recent > 0:
+        for turn in history[max(len(history) - keep_recent - appended, 0):max(len(history) - keep_recent, 0)]:
+            turn.compress()
+
+
+def upgrade_history(history):
+    """Converts, in place, a history saved as OpenAI-style dicts by an earlier version."""
+    if history and isinstance(history[0], dict):
+        history[:] = [Turn(message["role"], message["content"]) for message in history]
+    return history
+
+
+class TokenLedger:
+    """
+    Per-message token counts kept alongside the history list.
+
+    Counts are cached positionally, so each sync only has to count messages that
+    were appended since the last call. Callers that remove messages from the end
+    of the history must call truncate() so the cache stays aligned.
+    """
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = []
+        self.total = 0
+
+    def sync(self, history):
+        """Counts any messages appended since the last sync and returns the total."""
+        self.truncate(len(history))
+        for turn in history[len(self.counts):]:
+            count = estimate_tokens(turn.content)
+            self.counts.append(count)
+            self.total += count
+        return self.total
+
+    def truncate(self, length):
+        """Forgets the counts of every message from `length` onwards."""
+        if len(self.counts) > length:
+            self.total -= sum(self.counts[length:])
+            del self.counts[length:]
+
+    def replace(self, start, end, turns):
+        """Mirrors `history[start:end] = turns` in the cached counts."""
+        self.total -= sum(self.counts[start:end])
+        counts = [estimate_tokens(turn.content) for turn in turns]
+        self.counts[start:end] = counts
+        self.total += sum(counts)
+
+
+def summary_message(summary):
+    """Builds the history turn that carries the running summary."""
+    return Turn(USER, SUMMARY_PREFIX + summary)
+
+
+def summary_request(summary, turns, persona_name, max_words):
+    """Builds the prompt asking the model to fold `turns` into the running summary."""
+    speaker = {USER: "User", ASSISTANT: persona_name or "Persona"}
+    transcript = "\n".join(f"{speaker.get(turn.role, turn.role)}: {turn.content}" for turn in turns)
+    return [{
+        "role": "user",
+        "content": SUMMARY_INSTRUCTIONS.format(
+            max_words=max_words, summary=summary or "(none yet)", transcript=transcript
+        ),
+    }]
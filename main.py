@@ -1,7 +1,19 @@
+import asyncio
 import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
-from config import TELEGRAM_BOT_TOKEN, NAME, GOAL, SELECT_PERSONA
+from config import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE_URL, NAME, GOAL, SELECT_PERSONA, CONCURRENT_UPDATES, UPDATE_MODE, WEBHOOK_URL,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS,
+    METRICS_HOST, METRICS_PORT, EVENT_LOOP_LAG_INTERVAL, SHARD_WORKERS, OUTBOUND_GLOBAL_RATE, PERSONA_RELOAD_INTERVAL,
+    USER_DATA_PERSONA
+)
+from ai_service import opener_pool, preload_client
+from persona_data import PERSONAS
+from metrics import Gauge, monitor_event_loop_lag, start_metrics_server
+from outbound import FloodControlLimiter
+from session_store import SessionStore, create_session_backend, session_context_types
+from sharding import build_front_application
 from handlers import (
     start_command, start_get_name, start_get_goal, help_command, about_command,
     settings_command, end_command, create_command, investor_pitch_command,
@@ -14,15 +26,66 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    """Start the bot."""
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable not set. Exiting.")
-        print("ERROR: TELEGRAM_BOT_TOKEN environment variable not set. Please set it to run the bot.")
-        return
+# The only update types the registered handlers use. Telegram won't send anything else.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+def build_application(updater: bool = True, metrics_port: int = METRICS_PORT,
+                      session_store: SessionStore = None) -> Application:
+    """
+    Builds the bot Application: session store, lifecycle hooks and every handler.
+
+    Sharded workers pass updater=False and feed updates in themselves, serve their
+    metrics on a port of their own, and pass in the session store so they can wait
+    for sessions to be written before acknowledging updates.
+    """
+    # User sessions live in a persistent, memory-bounded store instead of the
+    # in-memory user_data, so simulations survive restarts.
+    if session_store is None:
+        session_store = SessionStore(create_session_backend())
+    Gauge(
+        "active_simulations", "Sessions in memory with an active simulation.",
+        function=lambda: sum(USER_DATA_PERSONA in session for session in session_store.cached_sessions()),
+    )
+    metrics_server = lag_monitor = persona_watcher = None
+
+    async def post_init(application: Application) -> None:
+        nonlocal metrics_server, lag_monitor, persona_watcher
+        session_store.start()
+        # The model client is created lazily; have it ready before the first turn
+        await preload_client()
+        # Pre-generate persona openers in the background so the first /create is instant
+        opener_pool.warm()
+        if PERSONA_RELOAD_INTERVAL:
+            persona_watcher = asyncio.create_task(PERSONAS.watch(PERSONA_RELOAD_INTERVAL))
+        if metrics_port:
+            metrics_server = await start_metrics_server(METRICS_HOST, metrics_port)
+            lag_monitor = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+
+    async def post_shutdown(application: Application) -> None:
+        if persona_watcher is not None:
+            persona_watcher.cancel()
+        if metrics_server is not None:
+            lag_monitor.cancel()
+            metrics_server.close()
+        await session_store.stop()
 
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Updates are processed concurrently so one user's model call doesn't queue everyone else.
+    # Sends are paced to stay inside Telegram's flood limits; sharded workers split the global rate.
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .context_types(session_context_types(session_store))
+        .rate_limiter(FloodControlLimiter(global_rate=OUTBOUND_GLOBAL_RATE / max(SHARD_WORKERS, 1)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder.base_url(TELEGRAM_API_BASE_URL)
+    if not updater:
+        builder.updater(None)
+    application = builder.build()
 
     # --- Conversation Handlers ---
 
@@ -58,9 +121,43 @@ def main() -> None:
     # --- Message Handler (Must be last to catch all non-command messages) ---
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
 
-    # Run the bot until the user presses Ctrl-C
-    print("Bot started. Press Ctrl-C to stop.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
+
+def run_application(application: Application) -> None:
+    """Receives updates by polling or webhook, as configured, until the user presses Ctrl-C."""
+    if UPDATE_MODE == "webhook":
+        if not WEBHOOK_URL or not WEBHOOK_SECRET_TOKEN:
+            logger.error("Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET_TOKEN to be set. Exiting.")
+            return
+        # The embedded server validates the secret token, queues each update and answers
+        # immediately; handlers run in the background.
+        print(f"Bot started with a webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}. Press Ctrl-C to stop.")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        print("Bot started. Press Ctrl-C to stop.")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+def main() -> None:
+    """Start the bot."""
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable not set. Exiting.")
+        print("ERROR: TELEGRAM_BOT_TOKEN environment variable not set. Please set it to run the bot.")
+        return
+
+    if SHARD_WORKERS > 1:
+        # This process only routes updates; the handlers run in the worker processes
+        print(f"Routing updates to {SHARD_WORKERS} worker processes.")
+        run_application(build_front_application())
+    else:
+        run_application(build_application())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,208 @@
+"""
+Lightweight in-process metrics with a Prometheus text endpoint.
+
+Counters, gauges and histograms are defined once at import time and updated on
+the hot path with a dict lookup and an addition. start_metrics_server() serves
+them at /metrics, together with the runtime switches for the sampling profiler.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from urllib.parse import parse_qs
+from profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (2, 4, 8, 16, 32, 64, 128, 256)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _samples(self):
+        if self.function is not None:
+            return [(self.name, "", self.function())]
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {value}" for name, labels, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A monotonically increasing value, optionally read from `function` at scrape time."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, optionally read from `function` at scrape time."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then the running sum and count
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, f'le="{bound}"'),
+                                cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+def render():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# --- Application Metrics ---
+
+HANDLER_LATENCY = Histogram("handler_latency_seconds", "Time spent in each Telegram handler.", ["handler"])
+HANDLER_ERRORS = Counter("handler_errors_total", "Exceptions raised by Telegram handlers.", ["handler"])
+LLM_LATENCY = Histogram("llm_request_seconds", "Upstream model call latency, including retries.", ["kind"])
+LLM_TIME_TO_FIRST_TOKEN = Histogram("llm_time_to_first_token_seconds", "Time until a streamed reply's first text.")
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "Prompt tokens sent to the model.", ["persona"])
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Completion tokens received.", ["persona"])
+LLM_ERRORS = Counter("llm_errors_total", "Model calls that failed after retries.", ["error"])
+HISTORY_LENGTH = Histogram("conversation_history_messages", "Messages sent to the model per call.",
+                           buckets=SIZE_BUCKETS)
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "How late the event loop woke up a periodic timer.",
+                           buckets=LAG_BUCKETS)
+
+
+def instrument_handler(handler):
+    """Records latency and errors of an async Telegram handler."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+    return wrapper
+
+
+async def monitor_event_loop_lag(interval):
+    """Records how much later than requested a sleep(interval) wakes up, until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+
+# --- HTTP Endpoint ---
+
+profiler = SamplingProfiler()
+
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        method, target = request_line.decode("latin-1").split(" ")[:2]
+        path, _, query = target.partition("?")
+
+        status, body = "200 OK", ""
+        if method != "GET":
+            status, body = "405 Method Not Allowed", "GET only\n"
+        elif path == "/metrics":
+            body = render()
+        elif path == "/debug/profile/start":
+            try:
+                interval = float(parse_qs(query).get("interval", [profiler.interval])[-1])
+                profiler.start(interval)
+            except ValueError as e:
+                status, body = "400 Bad Request", f"{e}\n"
+            else:
+                body = f"profiling every {profiler.interval * 1000:g} ms\n"
+        elif path == "/debug/profile/stop":
+            # Folded stacks: feed to flamegraph.pl or drop into speedscope
+            body = profiler.stop()
+        else:
+            status, body = "404 Not Found", "not found\n"
+
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except Exception:
+        logger.exception("Error serving metrics request")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    """Serves /metrics and the profiler switches on host:port. Returns the asyncio server."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return server
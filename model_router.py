@@ -0,0 +1,141 @@
+"""
+Model routing: picks the model, max_tokens and temperature for every model call.
+
+Each persona has a tier from MODEL_TIERS. A turn then moves one tier down for short
+banter early in a conversation or one tier up for a long message or history, and
+summaries go to the fastest tier. Separately, the router watches the latency of
+each tier; while a tier violates the latency SLO, its calls go to the next faster
+tier. Every decision is counted by tier and reason, so the cost/latency tradeoff
+can be tuned from the metrics.
+"""
+import logging
+import time
+from config import (
+    MODEL_TIERS, MODEL_DEFAULT_TIER, ROUTE_SHORT_MESSAGE_CHARS, ROUTE_LONG_MESSAGE_CHARS, ROUTE_SMALL_HISTORY_TOKENS,
+    ROUTE_LARGE_HISTORY_TOKENS, ROUTE_LATENCY_SLO, ROUTE_SLO_WINDOW, ROUTE_SLO_MIN_SAMPLES, ROUTE_DEGRADE_COOLDOWN,
+    HISTORY_SUMMARY_MAX_WORDS
+)
+from metrics import Counter, Gauge, Histogram
+from resilience import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+ROUTE_DECISIONS = Counter("llm_route_decisions_total", "Model calls by routed tier and the reason for it.",
+                          ["tier", "reason"])
+TIER_LATENCY = Histogram("llm_tier_latency_seconds",
+                         "Time to a reply or its first streamed text per tier, admission included.", ["tier"])
+TIER_COMPLETION_TOKENS = Counter("llm_tier_completion_tokens_total", "Completion tokens received per tier.", ["tier"])
+TIER_DEGRADED = Gauge("llm_tier_degraded", "1 while a tier's calls go to a faster tier after SLO violations.",
+                      ["tier"])
+
+# Roughly 1.3 tokens per English word, with some room so a summary isn't cut off
+SUMMARY_MAX_TOKENS = HISTORY_SUMMARY_MAX_WORDS * 2
+
+
+class Route:
+    """Where and how a model call is made, and why it was routed there."""
+
+    __slots__ = ("tier", "model", "max_tokens", "temperature", "reason")
+
+    def __init__(self, tier, model, max_tokens, temperature, reason):
+        self.tier = tier
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.reason = reason
+
+    def __repr__(self):
+        return (f"Route({self.tier}, model={self.model}, max_tokens={self.max_tokens}, "
+                f"temperature={self.temperature}, reason={self.reason})")
+
+
+class ModelRouter:
+    """
+    Routes model calls to tiers. `tiers` maps tier names, fastest first, to their model,
+    max_tokens and temperature. A tier is skipped for `cooldown` seconds once the p95 of
+    its last `window` latencies exceeds `slo`; an SLO of 0 disables the fallback.
+    """
+
+    def __init__(self, tiers=MODEL_TIERS, default_tier=MODEL_DEFAULT_TIER, slo=ROUTE_LATENCY_SLO,
+                 window=ROUTE_SLO_WINDOW, min_samples=ROUTE_SLO_MIN_SAMPLES, cooldown=ROUTE_DEGRADE_COOLDOWN):
+        self.tiers = tiers
+        self.order = list(tiers)
+        self.default_tier = default_tier
+        self.slo = slo
+        self.window = window
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._latency = {tier: LatencyTracker(window) for tier in self.order}
+        self._degraded_until = {}
+        self.fallbacks = 0
+
+    def degraded(self, tier):
+        """Whether `tier` is currently skipped because it violated the latency SLO."""
+        until = self._degraded_until.get(tier)
+        if until is None:
+            return False
+        if time.monotonic() < until:
+            return True
+        del self._degraded_until[tier]
+        TIER_DEGRADED.set(0, tier=tier)
+        logger.info("Model tier %s is back in service", tier)
+        return False
+
+    def route(self, persona=None, kind="turn", user_message="", history_tokens=0):
+        """
+        Picks the route for a call. `kind` is "opener", "turn" or "summary"; turns are
+        adjusted by the length of `user_message` and the `history_tokens` sent with it.
+        """
+        tier = getattr(persona, "model_tier", None) or self.default_tier
+        index = self.order.index(tier)
+        reason = "persona"
+        if kind == "summary":
+            index, reason = 0, "summary"
+        elif kind == "turn":
+            if len(user_message) >= ROUTE_LONG_MESSAGE_CHARS:
+                index, reason = index + 1, "long_message"
+            elif history_tokens >= ROUTE_LARGE_HISTORY_TOKENS:
+                index, reason = index + 1, "long_history"
+            elif len(user_message) <= ROUTE_SHORT_MESSAGE_CHARS and history_tokens < ROUTE_SMALL_HISTORY_TOKENS:
+                index, reason = index - 1, "short_turn"
+            index = min(max(index, 0), len(self.order) - 1)
+        while index > 0 and self.degraded(self.order[index]):
+            index, reason = index - 1, "slo_fallback"
+
+        tier = self.order[index]
+        settings = self.tiers[tier]
+        max_tokens, temperature = settings["max_tokens"], settings["temperature"]
+        if kind == "summary":
+            max_tokens = SUMMARY_MAX_TOKENS
+        elif persona is not None:
+            if persona.max_tokens:
+                max_tokens = min(max_tokens, persona.max_tokens)
+            if persona.temperature is not None:
+                temperature = persona.temperature
+        return Route(tier, settings["model"], max_tokens, temperature, reason)
+
+    def record(self, route, persona_name=None):
+        """Records that a model call is being made on `route`."""
+        ROUTE_DECISIONS.inc(tier=route.tier, reason=route.reason)
+        if route.reason == "slo_fallback":
+            self.fallbacks += 1
+        logger.debug("Routing a call for %s: %r", persona_name or "no persona", route)
+
+    def observe(self, route, seconds, completion_tokens=None):
+        """Records how long a call on `route` took and degrades its tier if it violates the SLO."""
+        TIER_LATENCY.observe(seconds, tier=route.tier)
+        if completion_tokens is not None:
+            TIER_COMPLETION_TOKENS.inc(completion_tokens, tier=route.tier)
+        latency = self._latency[route.tier]
+        latency.record(seconds)
+        # The fastest tier has nowhere to fall back to
+        if not self.slo or route.tier == self.order[0] or len(latency) < self.min_samples:
+            return
+        p95 = latency.quantile(0.95)
+        if p95 > self.slo and not self.degraded(route.tier):
+            self._degraded_until[route.tier] = time.monotonic() + self.cooldown
+            # Judge the tier afresh once the cooldown is over
+            self._latency[route.tier] = LatencyTracker(self.window)
+            TIER_DEGRADED.set(1, tier=route.tier)
+            logger.warning("Model tier %s p95 latency %.1fs exceeds the %.1fs SLO, using a faster tier for %.0fs",
+                           route.tier, p95, self.slo, self.cooldown)
@@ -0,0 +1,115 @@
+"""
+Pool of pre-generated persona openers.
+
+Opening lines are generated ahead of time from each persona's prompt with marker
+placeholders in place of the user's name and goal. When a simulation starts, an
+opener is taken from the pool and personalized with plain string replacement, so
+starting a simulation doesn't have to wait for a model round-trip. The pool is
+refilled in the background as openers are used.
+"""
+import asyncio
+import logging
+from collections import deque
+from config import OPENER_POOL_SIZE
+from persona_data import PERSONAS
+
+logger = logging.getLogger(__name__)
+
+NAME_MARKER = "{user_name}"
+GOAL_MARKER = "{user_goal}"
+
+OPENER_INSTRUCTIONS = (
+    "\n\nWrite only your opening message. If you refer to the user's name, write exactly "
+    f"{NAME_MARKER} instead of a name. If you refer to the user's goal, write exactly {GOAL_MARKER}."
+)
+
+
+def opener_request(persona_name):
+    """Builds the messages used to pre-generate an opener for `persona_name`."""
+    prompt = PERSONAS[persona_name].render(NAME_MARKER, GOAL_MARKER)
+    return [{"role": "user", "content": prompt + OPENER_INSTRUCTIONS}]
+
+
+def personalize(opener, user_name, user_goal):
+    """Fills the user's name and goal into a pre-generated opener."""
+    return opener.replace(NAME_MARKER, user_name).replace(GOAL_MARKER, user_goal)
+
+
+class OpenerPool:
+    """
+    Keeps up to `pool_size` pre-generated openers per persona.
+
+    `generate` is an async callable taking a persona name and returning an opener
+    containing the name/goal markers. A pool size of 0 disables the pool.
+    """
+
+    def __init__(self, generate, pool_size=OPENER_POOL_SIZE):
+        self.generate = generate
+        self.pool_size = pool_size
+        self._pools = {}
+        self._refills = {}
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, persona_name):
+        """
+        Returns an opener for `persona_name` with the markers still in place, for personalize(),
+        or None if the pool is empty. Either way a background refill is scheduled.
+        """
+        if self.pool_size <= 0:
+            return None
+
+        pool = self._pools.setdefault(persona_name, deque())
+        opener = pool.popleft() if pool else None
+        if opener is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.refill(persona_name)
+        return opener
+
+    def refill(self, persona_name):
+        """Schedules a background refill of `persona_name`'s pool unless one is running."""
+        task = self._refills.get(persona_name)
+        if self.pool_size > 0 and (task is None or task.done()):
+            self._refills[persona_name] = asyncio.create_task(self._refill(persona_name))
+
+    def reset(self, persona_names):
+        """
+        Drops the openers of `persona_names`, e.g. after their prompts were edited, and
+        refills the pools of those that still exist.
+        """
+        for persona_name in persona_names:
+            task = self._refills.pop(persona_name, None)
+            if task is not None:
+                task.cancel()
+            self._pools.pop(persona_name, None)
+            if persona_name in PERSONAS:
+                self.refill(persona_name)
+
+    def warm(self):
+        """Schedules a refill for every persona, e.g. at startup."""
+        for persona_name in PERSONAS:
+            self.refill(persona_name)
+
+    async def _refill(self, persona_name):
+        pool = self._pools.setdefault(persona_name, deque())
+        while len(pool) < self.pool_size:
+            try:
+                opener = await self.generate(persona_name)
+            except Exception as e:
+                logger.warning("Could not pre-generate an opener for %s: %s", persona_name, e)
+                return
+            if opener:
+                pool.append(opener)
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of each pool."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "pool_size": self.pool_size,
+            "pools": {name: len(pool) for name, pool in self._pools.items()},
+        }
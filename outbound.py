@@ -0,0 +1,212 @@
+"""
+Outbound Telegram messages: flood control, long-message splitting, formatting
+fallback and typing indicators.
+
+FloodControlLimiter is installed as the Application's rate limiter, so every Bot API
+call that targets a chat passes through it, whichever handler makes it. It spaces
+sends out with token buckets for the global and per-chat limits and, when Telegram
+still answers RetryAfter, pauses all sends for the requested time and retries.
+
+Handlers send text that may be long or carry model output with reply_text(), which
+splits it on safe boundaries and resends a chunk as plain text if Telegram rejects
+its formatting.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from telegram import Message
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+from admission import TokenBucket
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_CHAT_BUCKETS,
+    OUTBOUND_MAX_RETRIES, TELEGRAM_MESSAGE_LIMIT, TYPING_INDICATOR_DELAY, TYPING_INDICATOR_INTERVAL
+)
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SEND_WAIT = Histogram("telegram_send_wait_seconds", "Time a Telegram call waited for the flood limiter.", ["method"])
+RETRY_AFTER = Counter("telegram_retry_after_total", "RetryAfter errors returned by Telegram.", ["method"])
+TYPING_SKIPPED = Counter("telegram_typing_skipped_total", "Typing indicators skipped to save send budget.")
+FORMAT_FALLBACKS = Counter(
+    "telegram_format_fallbacks_total", "Messages resent as plain text after Telegram rejected their formatting."
+)
+
+# Preferred places to split a long message, best first
+SPLIT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def _retry_after_seconds(error):
+    # retry_after is turning into a timedelta; read it without the deprecation warning
+    value = getattr(error, "_retry_after", None)
+    if value is None:
+        value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class FloodControlLimiter(BaseRateLimiter):
+    """
+    Rate limiter for the Bot API. Calls with a chat_id wait for a token from that chat's
+    bucket and then from the global bucket, so a busy chat can't use up everyone else's
+    budget. A global rate of 0 disables throttling; RetryAfter is still honored.
+
+    Chat actions are best effort: they are dropped rather than delayed when there is no
+    budget to spare, since a late typing indicator is worse than none.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, max_retries=OUTBOUND_MAX_RETRIES):
+        self._global = TokenBucket(global_rate * 60, capacity=global_rate) if global_rate else None
+        self._chats = OrderedDict()
+        self._paused_until = 0.0
+        self.max_retries = max_retries
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Group and channel ids are negative, or an @username
+            rate = OUTBOUND_GROUP_RATE if isinstance(chat_id, str) or chat_id < 0 else OUTBOUND_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate * 60, capacity=OUTBOUND_CHAT_BURST)
+            if len(self._chats) > OUTBOUND_CHAT_BUCKETS:
+                # The least recently used chat has long since refilled its bucket
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _buckets(self, chat_id):
+        if self._global is None:
+            return (self._chat_bucket(chat_id),)
+        return self._chat_bucket(chat_id), self._global
+
+    async def _wait_turn(self, chat_id):
+        """Waits out any RetryAfter pause, then takes a token from each bucket, waiting for it if needed."""
+        while (pause := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+        for bucket in self._buckets(chat_id):
+            # Take the token now, going into debt if need be, so later callers queue up behind this one
+            delay = bucket.delay(1, time.monotonic())
+            bucket.consume(1)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def _try_take(self, chat_id):
+        """Takes a token from each bucket if all of them have one to spare right now."""
+        now = time.monotonic()
+        buckets = self._buckets(chat_id)
+        if now < self._paused_until or any(bucket.delay(1, now) for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.consume(1)
+        return True
+
+    def _pause(self, endpoint, error):
+        RETRY_AFTER.inc(method=endpoint)
+        seconds = _retry_after_seconds(error)
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds + 0.1)
+        logger.warning("Telegram flood limit hit on %s, pausing sends for %.1fs", endpoint, seconds)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """`rate_limit_args` may override the number of RetryAfter retries for a single call."""
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+
+        if endpoint == "sendChatAction":
+            if not self._try_take(chat_id):
+                TYPING_SKIPPED.inc()
+                return True
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._pause(endpoint, e)
+                return True
+
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        for attempt in range(max_retries + 1):
+            start = time.monotonic()
+            await self._wait_turn(chat_id)
+            SEND_WAIT.observe(time.monotonic() - start, method=endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._pause(endpoint, e)
+                if attempt == max_retries:
+                    raise
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Splits `text` into chunks of at most `limit` characters, preferring to break between
+    paragraphs, then lines, sentences and words. Only text without any of those in the
+    second half of a chunk is cut mid-word.
+    """
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        for separator in SPLIT_SEPARATORS:
+            cut = window.rfind(separator)
+            if cut > limit // 2:
+                cut += len(separator)
+                break
+        else:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+async def _reply_chunk(message: Message, text: str, parse_mode, reply_markup) -> Message:
+    try:
+        return await message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Model output with a stray * or _ is not valid Markdown; send it unformatted rather than not at all
+        if parse_mode is None or "can't parse entities" not in str(e).lower():
+            raise
+        logger.warning("Telegram rejected the formatting of a reply, sending it as plain text: %s", e)
+        FORMAT_FALLBACKS.inc()
+        return await message.reply_text(text, reply_markup=reply_markup)
+
+
+async def reply_text(message: Message, text: str, parse_mode=None, reply_markup=None) -> Message:
+    """
+    Replies to `message` with `text`, split into several messages if it is too long for
+    one. The reply markup goes on the last message. Returns the last message sent.
+    """
+    chunks = split_message(text)
+    for index, chunk in enumerate(chunks):
+        sent = await _reply_chunk(message, chunk, parse_mode, reply_markup if index == len(chunks) - 1 else None)
+    return sent
+
+
+@contextlib.asynccontextmanager
+async def typing_indicator(message: Message):
+    """Shows "typing…" in the chat of `message` while the block runs, unless it finishes quickly."""
+    async def keep_typing():
+        await asyncio.sleep(TYPING_INDICATOR_DELAY)
+        while True:
+            try:
+                await message.reply_chat_action(ChatAction.TYPING)
+            except TelegramError as e:
+                logger.debug("Could not send typing indicator: %s", e)
+            await asyncio.sleep(TYPING_INDICATOR_INTERVAL)
+
+    task = asyncio.create_task(keep_typing())
+    try:
+        yield
+    finally:
+        task.cancel()
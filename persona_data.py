@@ -1,80 +1,266 @@
+"""
+Persona registry.
+
+Personas are defined by the JSON files in PERSONA_DIR (or YAML files, with PyYAML
+installed), one persona per file, shown in the selection menu in file name order.
+Every file is validated when it is loaded and its prompt template is split into
+literal text and fields once, so personalizing a prompt is a plain join. The
+selection keyboard is built once per load.
+
+The directory is watched for edits. A reload replaces the personas in place,
+all at once, and only if every file is valid. Sessions keep only the persona's
+name, so they pick up an edited prompt on their next turn, and a removed persona
+stays available to the sessions already using it.
+"""
+import asyncio
+import json
+import logging
+import os
+import string
+from collections.abc import Mapping
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import PERSONA_DIR, MODEL_TIERS, MODEL_DEFAULT_TIER
 
-PERSONAS = {
-    "Interviewer": {
-        "description": "A professional, sharp-witted interviewer for a top-tier tech company.",
-        "prompt": (
-            "You are a professional, sharp-witted interviewer for a top-tier tech company. "
-            "Your goal is to assess the user's technical skills, cultural fit, and problem-solving abilities. "
-            "Be challenging but fair. The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start the interview by asking a standard opening question."
-        )
-    },
-    "Investor": {
-        "description": "A skeptical, tough-to-impress venture capitalist on a show like Shark Tank.",
-        "prompt": (
-            "You are a skeptical, tough-to-impress venture capitalist on a show like Shark Tank. "
-            "You have a limited budget and high standards. Ask probing questions about the user's business model, "
-            "market size, and team. The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start by demanding the user's 60-second pitch."
-        )
-    },
-    "Crush": {
-        "description": "The user's romantic crush. Charming, slightly mysterious, and funny.",
-        "prompt": (
-            "You are the user's romantic crush. You are charming, slightly mysterious, and have a good sense of humor. "
-            "Respond in a flirty, engaging, and sometimes elusive manner. The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start the conversation with a casual, slightly teasing remark."
-        )
-    },
-    "Angry Customer": {
-        "description": "An extremely frustrated customer demanding an immediate, high-level resolution.",
-        "prompt": (
-            "You are an extremely frustrated customer whose expensive product has failed catastrophically. "
-            "You are demanding, emotional, and expect an immediate, high-level resolution. Do not accept simple apologies. "
-            "The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start by expressing your extreme dissatisfaction and demanding to speak to a manager."
-        )
-    },
-    "Therapist": {
-        "description": "A compassionate, non-judgmental cognitive behavioral therapist.",
-        "prompt": (
-            "You are a compassionate, non-judgmental cognitive behavioral therapist. Your responses should be empathetic, "
-            "reflective, and guide the user toward self-discovery and coping mechanisms. The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start by asking the user what brings them to therapy today."
-        )
-    },
-    "Teacher": {
-        "description": "A strict but knowledgeable high school history teacher.",
-        "prompt": (
-            "You are a strict but knowledgeable high school history teacher. You are giving the user a pop quiz on World War II. "
-            "Your tone is formal and academic. Correct the user's mistakes precisely. The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start the quiz with the first question."
+try:
+    import yaml
+except ImportError:  # YAML persona files are optional
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_FIELDS = ("user_name", "user_goal")
+CALLBACK_PREFIX = "select_"
+MAX_CALLBACK_DATA = 64  # bytes, Telegram's limit for callback_data
+
+
+class PersonaError(ValueError):
+    """A persona file is unreadable or invalid, or a persona doesn't exist."""
+
+
+def _compile(template):
+    """Splits a prompt template into (literal, field) pairs, allowing only the plain user fields."""
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise PersonaError(f"invalid prompt template: {e}") from None
+    parts = []
+    for literal, field, format_spec, conversion in parsed:
+        if field is not None and (field not in TEMPLATE_FIELDS or format_spec or conversion):
+            raise PersonaError(
+                f"prompt field {{{field}}} is not allowed, use only {', '.join(f'{{{f}}}' for f in TEMPLATE_FIELDS)}"
+            )
+        parts.append((literal, field))
+    return tuple(parts)
+
+
+class Persona:
+    """One persona: its menu entry, prompt template and per-persona settings."""
+
+    __slots__ = (
+        "name", "description", "prompt", "history_token_budget", "cache_responses", "model_tier", "temperature",
+        "max_tokens", "_parts",
+    )
+
+    def __init__(self, name, description, prompt, history_token_budget=None, cache_responses=False,
+                 model_tier=MODEL_DEFAULT_TIER, temperature=None, max_tokens=None):
+        self.name = name
+        self.description = description
+        self.prompt = prompt
+        self.history_token_budget = history_token_budget
+        self.cache_responses = cache_responses
+        self.model_tier = model_tier
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self._parts = _compile(prompt)
+
+    def render(self, user_name, user_goal):
+        """The prompt with the user's name and goal filled in."""
+        values = {"user_name": user_name, "user_goal": user_goal}
+        return "".join([literal + values[field] if field else literal for literal, field in self._parts])
+
+    def __eq__(self, other):
+        return isinstance(other, Persona) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
         )
-    },
-    "Politician": {
-        "description": "A charismatic, evasive, and highly experienced politician.",
-        "prompt": (
-            "You are a charismatic, evasive, and highly experienced politician running for a major office. "
-            "When asked a direct question, pivot to your talking points, use vague language, and appeal to a broad base. "
-            "The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start by giving a brief, generic campaign speech."
+
+    __hash__ = None
+
+
+# Field name -> (type, required)
+_SCHEMA = {
+    "name": (str, True),
+    "description": (str, True),
+    "prompt": (str, True),
+    "history_token_budget": (int, False),
+    "cache_responses": (bool, False),
+    "model_tier": (str, False),
+    "temperature": ((int, float), False),
+    "max_tokens": (int, False),
+}
+
+
+def parse_persona(data):
+    """Builds a Persona from the contents of a persona file, or raises PersonaError."""
+    if not isinstance(data, dict):
+        raise PersonaError("expected an object with the persona's fields")
+    unknown = set(data) - set(_SCHEMA)
+    if unknown:
+        raise PersonaError(f"unknown fields: {', '.join(sorted(unknown))}")
+    for field, (kind, required) in _SCHEMA.items():
+        if field not in data:
+            if required:
+                raise PersonaError(f"missing field {field!r}")
+        # bool is a subclass of int, so check it isn't passed off as a number
+        elif not isinstance(data[field], kind) or (kind is not bool and isinstance(data[field], bool)):
+            expected = "a number" if isinstance(kind, tuple) else f"of type {kind.__name__}"
+            raise PersonaError(f"{field!r} must be {expected}")
+    name = data["name"].strip()
+    if not name or "_" in name:
+        raise PersonaError("'name' must be non-empty and must not contain '_'")
+    if len((CALLBACK_PREFIX + name).encode()) > MAX_CALLBACK_DATA:
+        raise PersonaError("'name' is too long for a selection button")
+    for field in ("history_token_budget", "max_tokens"):
+        if data.get(field, 1) <= 0:
+            raise PersonaError(f"{field!r} must be positive")
+    if not 0 <= data.get("temperature", 0) <= 2:
+        raise PersonaError("'temperature' must be between 0 and 2")
+    if data.get("model_tier", MODEL_DEFAULT_TIER) not in MODEL_TIERS:
+        raise PersonaError(f"'model_tier' must be one of {', '.join(MODEL_TIERS)}")
+    return Persona(
+        name, data["description"], data["prompt"],
+        history_token_budget=data.get("history_token_budget"), cache_responses=data.get("cache_responses", False),
+        model_tier=data.get("model_tier", MODEL_DEFAULT_TIER), temperature=data.get("temperature"),
+        max_tokens=data.get("max_tokens"),
+    )
+
+
+def _load_file(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        if yaml is None:
+            raise PersonaError("PyYAML is needed to load YAML persona files")
+        return yaml.safe_load(f)
+
+
+class PersonaRegistry(Mapping):
+    """
+    The personas in `directory`, by name, in menu order. Lookups and iteration only see
+    the current personas; resolve() also finds removed ones still used by sessions.
+
+    Listeners added with add_listener() are called with the names of the personas a
+    reload added, changed or removed.
+    """
+
+    EXTENSIONS = (".json", ".yaml", ".yml")
+
+    def __init__(self, directory=PERSONA_DIR):
+        self.directory = directory
+        self._personas = {}
+        self._retired = {}
+        self._signature = None
+        self._listeners = []
+        self.keyboard = InlineKeyboardMarkup([])
+        self.reloads = 0
+        self.reload_errors = 0
+        self.reload(strict=True)
+
+    def __getitem__(self, name):
+        return self._personas[name]
+
+    def __iter__(self):
+        return iter(self._personas)
+
+    def __len__(self):
+        return len(self._personas)
+
+    def resolve(self, name):
+        """Returns the persona `name`, even if it was removed since a session started it."""
+        persona = self._personas.get(name) or self._retired.get(name)
+        if persona is None:
+            raise PersonaError(f"Unknown persona: {name}")
+        return persona
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _files(self):
+        return sorted(
+            os.path.join(self.directory, entry) for entry in os.listdir(self.directory)
+            if entry.endswith(self.EXTENSIONS)
         )
-    },
-    "Celebrity": {
-        "description": "A famous, slightly eccentric Hollywood actor.",
-        "prompt": (
-            "You are a famous, slightly eccentric Hollywood actor known for your dramatic roles and love of obscure philosophy. "
-            "Your responses should be grand, self-referential, and occasionally quote Shakespeare. "
-            "The user's name is {user_name} and their goal for using this bot is: {user_goal}. "
-            "Start by dramatically reflecting on the nature of fame."
+
+    def _scan(self):
+        """The persona files with their modification times and sizes, to tell whether any changed."""
+        signature = []
+        for path in self._files():
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _load(self, signature):
+        personas = {}
+        for path, _, _ in signature:
+            try:
+                persona = parse_persona(_load_file(path))
+            except Exception as e:  # unreadable file, bad JSON or YAML, invalid persona
+                raise PersonaError(f"{path}: {e}") from None
+            if persona.name in personas:
+                raise PersonaError(f"{path}: persona {persona.name!r} is defined twice")
+            personas[persona.name] = persona
+        if not personas:
+            raise PersonaError(f"no persona files in {self.directory}")
+        return personas
+
+    def reload(self, strict=False):
+        """
+        Loads the persona files again if any of them changed. Returns whether the
+        personas were replaced. An invalid set of files raises PersonaError if
+        `strict`, and is otherwise logged once and ignored, keeping the current personas.
+        """
+        try:
+            signature = self._scan()
+            if signature == self._signature:
+                return False
+            personas = self._load(signature)
+        except (OSError, PersonaError) as e:
+            if strict:
+                raise PersonaError(str(e)) from None
+            if not isinstance(e, OSError):
+                # Don't report the same broken files again until they change
+                self._signature = signature
+            self.reload_errors += 1
+            logger.error("Keeping the current personas, could not reload them: %s", e)
+            return False
+
+        changed = {name for name in personas.keys() | self._personas.keys()
+                   if personas.get(name) != self._personas.get(name)}
+        for name in self._personas.keys() - personas.keys():
+            self._retired[name] = self._personas[name]
+        for name in personas:
+            self._retired.pop(name, None)
+        self._personas = personas
+        self._signature = signature
+        self.keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(name, callback_data=CALLBACK_PREFIX + name)] for name in personas]
         )
-    },
-}
+        if self.reloads:
+            logger.info("Reloaded personas: %s changed", ", ".join(sorted(changed)) or "nothing")
+        self.reloads += 1
+        for listener in self._listeners:
+            listener(changed)
+        return True
+
+    async def watch(self, interval):
+        """Reloads the personas whenever their files change, checking every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+
+PERSONAS = PersonaRegistry()
+
 
 def get_persona_keyboard():
-    """Generates the inline keyboard for persona selection."""
-    keyboard = []
-    for persona_name in PERSONAS.keys():
-        keyboard.append([InlineKeyboardButton(persona_name, callback_data=f"select_{persona_name}")])
-    return InlineKeyboardMarkup(keyboard)
+    """Returns the inline keyboard for persona selection, built once per load."""
+    return PERSONAS.keyboard
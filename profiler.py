@@ -0,0 +1,64 @@
+"""
+Sampling profiler for the event loop thread.
+
+A background thread periodically captures the event loop thread's Python stack
+and counts identical stacks. The result is in the "folded" format understood by
+flamegraph.pl and speedscope. Sampling costs nothing while the profiler is off.
+"""
+import math
+import sys
+import threading
+from collections import Counter
+
+# Shorter intervals would keep the sampler thread holding the GIL and starve the loop it profiles
+MIN_INTERVAL = 0.001
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that called start()."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """
+        Starts sampling the calling thread (normally the event loop thread). Raises
+        ValueError for an interval below MIN_INTERVAL seconds.
+        """
+        if interval is not None and not (math.isfinite(interval) and interval >= MIN_INTERVAL):
+            raise ValueError(f"interval must be a number of seconds of at least {MIN_INTERVAL:g}")
+        if self._thread is not None:
+            return
+        if interval is not None:
+            self.interval = interval
+        self._samples.clear()
+        self._stop.clear()
+        target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, args=(target,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling and returns the folded stacks collected so far."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    def _run(self, target):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
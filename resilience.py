@@ -0,0 +1,232 @@
+"""
+Tail-latency controls for model calls: deadlines, retries, hedging and a circuit breaker.
+
+Every attempt runs under a per-attempt timeout and the whole call under an overall
+deadline. Only errors that are worth retrying (timeouts, connection failures, 429s
+and 5xx responses) are retried, after an exponential backoff with full jitter. If
+hedging is enabled and an attempt is still running at the recent p95 latency, a
+second attempt is started and whichever finishes first wins. Consecutive provider
+failures open a circuit breaker that fails calls fast until a cooldown has passed.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from config import (
+    LLM_MAX_ATTEMPTS, LLM_ATTEMPT_TIMEOUT, LLM_CALL_DEADLINE, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX,
+    LLM_HEDGING, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES, LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_COOLDOWN
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+def is_retryable(error):
+    """Whether a failed model call may succeed if it is simply tried again."""
+    # Imported here: openai is slow to import and only needed once a call has failed
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+    if isinstance(error, (asyncio.TimeoutError, APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Exponential backoff with full jitter for the given 0-based retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def quantile(self, q):
+        """Returns the q-quantile (0-1) of the window, or None if it is empty."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and stays open for `cooldown`
+    seconds. After that a single trial call is let through; its outcome closes the
+    breaker again or re-opens it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def check(self):
+        """Raises CircuitOpenError unless a call may go ahead."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            raise CircuitOpenError("The model provider is failing; not sending more requests for now.")
+        if state == "half-open":
+            self._trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def abandon_trial(self):
+        """Forgets a trial call that ended without an outcome, so the next call can be the trial."""
+        self._trial_running = False
+
+
+class ResilientCaller:
+    """Runs model calls with deadlines, classified retries, hedging and a circuit breaker."""
+
+    def __init__(self, max_attempts=LLM_MAX_ATTEMPTS, attempt_timeout=LLM_ATTEMPT_TIMEOUT,
+                 deadline=LLM_CALL_DEADLINE, hedging=LLM_HEDGING, hedge_quantile=LLM_HEDGE_QUANTILE,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, breaker=None):
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None if hedging isn't possible yet."""
+        if not self.hedging or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.quantile(self.hedge_quantile)
+
+    async def call(self, attempt, hedge=True, admit=None):
+        """
+        Awaits `attempt()` (a factory returning a new awaitable per attempt) until it
+        succeeds, fails with a non-retryable error, or the attempts or deadline run out.
+
+        The first attempt is assumed to be admitted by the caller already. Retries and
+        hedges are requests of their own, so `admit()`, if given, is awaited before each.
+        """
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        for attempt_number in range(self.max_attempts):
+            if attempt_number and admit is not None:
+                await admit()
+            self.breaker.check()
+            timeout = min(self.attempt_timeout, deadline - loop.time())
+            if timeout <= 0:
+                # The wait for admission used up the deadline; the provider wasn't involved
+                self.breaker.abandon_trial()
+                self.failures += 1
+                raise asyncio.TimeoutError()
+            start = loop.time()
+            try:
+                if hedge:
+                    result = await self._hedged(attempt, timeout, admit)
+                else:
+                    result = await asyncio.wait_for(attempt(), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered; the request itself was bad
+                    self.breaker.record_success()
+                    self.failures += 1
+                    raise
+                self.breaker.record_failure()
+                delay = backoff_delay(attempt_number)
+                if attempt_number + 1 == self.max_attempts or loop.time() + delay >= deadline:
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: the provider gave no verdict, and a half-open breaker must not wait for one forever
+                self.breaker.abandon_trial()
+                raise
+            self.latency.record(loop.time() - start)
+            self.breaker.record_success()
+            return result
+
+    @staticmethod
+    async def _admitted(attempt, admit):
+        if admit is not None:
+            await admit()
+        return await attempt()
+
+    async def _hedged(self, attempt, timeout, admit=None):
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await asyncio.wait_for(attempt(), timeout)
+
+        loop = asyncio.get_running_loop()
+        give_up = loop.time() + timeout
+        primary = asyncio.ensure_future(attempt())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                tasks.add(asyncio.ensure_future(self._admitted(attempt, admit)))
+            while True:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(0.0, give_up - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    if not tasks:
+                        raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        """Returns call, retry, hedge and failure counters plus the breaker state."""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+            "p95_seconds": self.latency.quantile(0.95),
+        }
@@ -0,0 +1,135 @@
+"""
+Exact-prefix cache of model replies for personas that opt in with "cache_responses".
+
+Early turns of a simulation are often identical across users: the same persona
+prompt, the same opener and short, similar first answers. The cache key is a hash
+of the persona, model, generation settings and every history turn sent to the model, with
+the user's name and goal replaced by markers and whitespace and case normalized.
+Only replies that don't mention the user's name or goal are stored, along with pooled
+openers, which already carry the markers and are personalized on the way out. That
+way one user's cached reply can be served to another.
+
+Entries live in a bounded LRU with a TTL and, optionally, in a SQLite file that
+survives restarts and is shared by sharded workers.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DB_PATH
+from openers import NAME_MARKER, GOAL_MARKER
+
+# Shorter names and goals are likely to be common words, which would be replaced in
+# unrelated history turns and give different conversations the same key
+MIN_NAME_LENGTH = 3
+MIN_GOAL_LENGTH = 8
+
+
+def _word_pattern(value):
+    """Matches `value` only as a whole word or phrase, not inside a longer word."""
+    return re.compile(rf"(?<!\w){re.escape(value)}(?!\w)")
+
+
+def generalize(text, user_name, user_goal):
+    """Replaces the user's name and goal in `text` with the markers personalize() fills in."""
+    if user_goal:
+        text = _word_pattern(user_goal).sub(GOAL_MARKER, text)
+    if user_name:
+        text = _word_pattern(user_name).sub(NAME_MARKER, text)
+    return text
+
+
+def is_cacheable(user_name, user_goal):
+    """Whether replies for this user can be shared: their name and goal must be safe to replace in the key."""
+    return (not user_name or len(user_name) >= MIN_NAME_LENGTH) and (
+        not user_goal or len(user_goal) >= MIN_GOAL_LENGTH
+    )
+
+
+def cache_key(persona, model, temperature, max_tokens, turns, user_name, user_goal):
+    """Hash of everything that determines the reply to the history `turns`, independent of who the user is."""
+    digest = hashlib.blake2b(json.dumps([persona, model, temperature, max_tokens]).encode(), digest_size=16)
+    for turn in turns:
+        content = " ".join(generalize(turn.content, user_name, user_goal).split()).casefold()
+        digest.update(b"\x00" + turn.role.encode() + b"\x00" + content.encode())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU of up to `max_entries` replies that expire after `ttl` seconds, backed by a
+    SQLite file at `db_path` if one is given. A size of 0 disables the cache.
+
+    Disk reads only happen on a memory miss and disk writes only after a model call,
+    so both stay off the common path.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._db = None
+        if db_path and max_entries > 0:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached reply for `key`, or None."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT reply, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, key, reply):
+        expires_at = time.time() + self.ttl
+        self._remember(key, reply, expires_at)
+        if self._db is not None:
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, reply, expires_at) VALUES (?, ?, ?)",
+                    (key, reply, expires_at),
+                )
+
+    def _remember(self, key, reply, expires_at):
+        self._entries[key] = (expires_at, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
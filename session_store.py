@@ -0,0 +1,288 @@
+"""
+Persistent, memory-bounded storage for per-user session data.
+
+Sessions hold the USER_DATA_* keys from config.py. Only the most recently active
+sessions are kept in memory; the rest are evicted (least recently used first) and
+reloaded from the backend on the user's next message. Changes are written back
+in batches by a background flusher instead of once per turn.
+"""
+import asyncio
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from telegram.ext import CallbackContext, ContextTypes
+from config import (
+    PERSISTED_USER_DATA_KEYS, SESSION_BACKEND, SESSION_DB_PATH, SESSION_CACHE_SIZE,
+    SESSION_FLUSH_INTERVAL, SESSION_FLUSH_BATCH_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SessionBackend:
+    """Interface for the durable storage behind a SessionStore."""
+
+    def load(self, user_id):
+        """Returns the serialized session for `user_id`, or None if there is none."""
+        raise NotImplementedError
+
+    def save_many(self, sessions):
+        """Durably writes a {user_id: serialized session} mapping in one batch."""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases any resources held by the backend."""
+
+
+class MemorySessionBackend(SessionBackend):
+    """Keeps serialized sessions in a dict. Useful for benchmarks and local runs."""
+
+    def __init__(self):
+        self._sessions = {}
+
+    def load(self, user_id):
+        return self._sessions.get(user_id)
+
+    def save_many(self, sessions):
+        self._sessions.update(sessions)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Stores sessions in a SQLite database in WAL mode.
+
+    Reads happen on the caller's thread while batched writes usually run in a worker
+    thread, so each side gets its own connection. WAL lets the two proceed without
+    blocking each other, and synchronous=NORMAL means one fsync per checkpoint
+    rather than one per transaction.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._reader = self._connect()
+        self._writer = self._connect()
+        self._write_lock = threading.Lock()
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._writer.commit()
+
+    def _connect(self):
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def load(self, user_id):
+        row = self._reader.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, sessions):
+        now = time.time()
+        with self._write_lock, self._writer:
+            self._writer.executemany(
+                "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(user_id, data, now) for user_id, data in sessions.items()],
+            )
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+def create_session_backend(name=SESSION_BACKEND, path=SESSION_DB_PATH):
+    """Builds the session backend selected in config.py."""
+    if name == "sqlite":
+        return SQLiteSessionBackend(path)
+    if name == "memory":
+        return MemorySessionBackend()
+    raise ValueError(f"Unknown session backend: {name}")
+
+
+class SessionStore:
+    """
+    LRU cache of user sessions in front of a SessionBackend, with write-behind flushing.
+
+    Every session handed out by get() is assumed to be modified and is queued for the
+    next flush. Evicted sessions stay in that queue until they are written, and a reload
+    before then returns the very same dict, so no update is lost to eviction. Callers
+    that must know a change is durable await persist().
+    """
+
+    def __init__(self, backend, cache_size=SESSION_CACHE_SIZE, flush_interval=SESSION_FLUSH_INTERVAL,
+                 flush_batch_size=SESSION_FLUSH_BATCH_SIZE):
+        self.backend = backend
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._cache = OrderedDict()
+        self._dirty = {}
+        # Resolved with True once the batch that takes the current _dirty sessions is written,
+        # or False if writing it failed. _saving maps each session of the batch being written
+        # to its dict and that batch's future, so a reload mid-write finds the live dict.
+        self._batch_saved = None
+        self._saving = {}
+        self._flush_requested = None
+        self._flusher = None
+        self._stopping = False
+        self.loads = 0
+        self.evictions = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def cached_sessions(self):
+        """Returns the sessions currently held in memory."""
+        return self._cache.values()
+
+    def _unwritten(self, user_id):
+        """Returns the evicted session of `user_id` that is queued or being written, if any."""
+        session = self._dirty.get(user_id)
+        if session is None and user_id in self._saving:
+            session = self._saving[user_id][0]
+        return session
+
+    def get(self, user_id):
+        """Returns the session dict for `user_id`, loading it from the backend if needed."""
+        session = self._cache.get(user_id)
+        if session is not None:
+            self._cache.move_to_end(user_id)
+        else:
+            session = self._unwritten(user_id)
+            if session is None:
+                session = self._load(user_id)
+            self._cache[user_id] = session
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+        self._dirty[user_id] = session
+        if len(self._dirty) >= self.flush_batch_size and self._flush_requested is not None:
+            self._flush_requested.set()
+        return session
+
+    def _load(self, user_id):
+        self.loads += 1
+        data = self.backend.load(user_id)
+        return pickle.loads(data) if data is not None else {}
+
+    def _take_dirty(self):
+        """
+        Serializes and clears the pending writes. Returns them with the future their
+        save resolves. Must run on the event loop thread.
+        """
+        dirty, self._dirty = self._dirty, {}
+        saved = self._batch_saved
+        if saved is not None:
+            self._batch_saved = saved.get_loop().create_future()
+        for user_id, session in dirty.items():
+            self._saving[user_id] = (session, saved)
+        batch = {
+            user_id: pickle.dumps(
+                {key: session[key] for key in PERSISTED_USER_DATA_KEYS if key in session},
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+            for user_id, session in dirty.items()
+        }
+        return batch, saved
+
+    def _finish_batch(self, batch, saved, ok):
+        # Only one batch is written at a time, so every session in it is done
+        for user_id in batch:
+            self._saving.pop(user_id, None)
+        if saved is not None:
+            saved.set_result(ok)
+
+    def flush(self):
+        """Synchronously writes every pending session to the backend."""
+        batch, saved = self._take_dirty()
+        try:
+            if batch:
+                self.backend.save_many(batch)
+                self.flushes += 1
+        except Exception:
+            self._finish_batch(batch, saved, False)
+            raise
+        self._finish_batch(batch, saved, True)
+
+    async def persist(self, user_id):
+        """
+        Marks `user_id`'s session as modified and waits until a flush has written it,
+        retrying with later flushes if one fails.
+        """
+        session = self._cache.get(user_id)
+        if session is None:
+            session = self._unwritten(user_id)
+        if session is not None:
+            self._dirty[user_id] = session
+        if self._flusher is None:
+            self.flush()
+            return
+        while True:
+            saved = self._batch_saved if user_id in self._dirty else self._saving.get(user_id, (None, None))[1]
+            if saved is None or await asyncio.shield(saved):
+                return
+
+    async def _run_flusher(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            batch, saved = self._take_dirty()
+            if not batch:
+                self._finish_batch(batch, saved, True)
+                continue
+            try:
+                await asyncio.to_thread(self.backend.save_many, batch)
+                self.flushes += 1
+            except Exception:
+                logger.exception("Failed to flush %d sessions", len(batch))
+                # Requeue anything that hasn't been touched since, so the next flush retries it.
+                for user_id in batch:
+                    self._dirty.setdefault(user_id, self._saving[user_id][0])
+                self._finish_batch(batch, saved, False)
+                continue
+            self._finish_batch(batch, saved, True)
+
+    def start(self):
+        """Starts the background write-behind flusher on the running event loop."""
+        self._stopping = False
+        self._flush_requested = asyncio.Event()
+        self._batch_saved = asyncio.get_running_loop().create_future()
+        self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stops the flusher, writes any remaining sessions and closes the backend."""
+        if self._flusher is not None:
+            # Not cancelled: a batch being written in the worker thread would be lost, and the
+            # backend closed under it. The flusher writes what is queued and then exits.
+            self._stopping = True
+            self._flush_requested.set()
+            await self._flusher
+            self._flusher = None
+        self.flush()
+        self.backend.close()
+
+
+def session_context_types(store):
+    """
+    Returns ContextTypes whose `context.user_data` is served from `store`, so the
+    handlers keep using context.user_data unchanged.
+    """
+
+    class SessionContext(CallbackContext):
+        @property
+        def user_data(self):
+            if self._user_id is not None:
+                return store.get(self._user_id)
+            return None
+
+    return ContextTypes(context=SessionContext)
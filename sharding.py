@@ -0,0 +1,293 @@
+"""
+Sharded deployment: a front process receives updates and routes each one, by a
+consistent hash of its user id, to one of SHARD_WORKERS worker processes.
+
+Each worker runs the full bot Application without an updater and owns the
+user_data and conversation state of the users routed to it, so nothing is locked
+across processes. The front keeps every update until its worker acknowledges it,
+which a worker does only once the user's session changes are written to the
+session database. A worker that dies is restarted on the same shard and its
+unacknowledged updates are replayed, so in-flight turns are not lost (delivery
+is at least once).
+"""
+import asyncio
+import bisect
+import collections
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from config import (
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE_URL, METRICS_HOST, METRICS_PORT, EVENT_LOOP_LAG_INTERVAL, SHARD_WORKERS,
+    SHARD_VIRTUAL_NODES, SHARD_SUPERVISE_INTERVAL, SHARD_STOP_TIMEOUT
+)
+from metrics import Counter, Gauge, monitor_event_loop_lag, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+SHARD_ROUTED = Counter("shard_routed_updates_total", "Updates routed to each worker.", ["worker"])
+SHARD_RESTARTS = Counter("shard_worker_restarts_total", "Workers restarted after exiting unexpectedly.")
+SHARD_REPLAYED = Counter("shard_replayed_updates_total", "Unacknowledged updates replayed to a restarted worker.")
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring. Each node owns `virtual_nodes` points on the ring, so keys
+    spread evenly and changing the number of nodes only moves about 1/N of them.
+    """
+
+    def __init__(self, nodes, virtual_nodes=SHARD_VIRTUAL_NODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._nodes[index % len(self._nodes)]
+
+
+def shard_key(update: Update) -> int:
+    """
+    The user an update belongs to; every update of a user goes to the same worker.
+    Sessions are stored per user, so routing by chat would let two workers cache and
+    write back the same session when a user is active in several chats.
+    """
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return 0
+
+
+# --- Worker Side ---
+
+class _AckTracker:
+    """
+    Acknowledges a user's updates only once they and every earlier update of that user
+    are done. A message merged into another message's turn returns before that turn is
+    answered; holding its ack back keeps it in the replay if the worker dies meanwhile.
+    """
+
+    def __init__(self, index, acks):
+        self._index = index
+        self._acks = acks
+        self._pending = {}
+
+    def begin(self, key, update_id):
+        self._pending.setdefault(key, collections.deque()).append([update_id, False])
+
+    def done(self, key, update_id):
+        pending = self._pending[key]
+        for entry in pending:
+            if entry[0] == update_id:
+                entry[1] = True
+                break
+        acked = []
+        while pending and pending[0][1]:
+            acked.append(pending.popleft()[0])
+        if not pending:
+            del self._pending[key]
+        if acked:
+            self._acks.put((self._index, acked))
+
+
+async def _process(application, session_store, tracker, key, update_id, data):
+    user_id = None
+    try:
+        update = Update.de_json(data, application.bot)
+        if update.effective_user is not None:
+            user_id = update.effective_user.id
+        await application.update_processor.process_update(update, application.process_update(update))
+    except Exception:
+        # Handler errors are already reported by the application; this is a bad update.
+        # Acknowledge it anyway so it isn't replayed forever.
+        logger.exception("Shard worker failed to process update %s", update_id)
+    if user_id is not None:
+        # Sessions are written behind; until this update's changes are durable, a crash must replay it
+        await session_store.persist(user_id)
+    tracker.done(key, update_id)
+
+
+def _next_batch(inbox):
+    """Blocks for one item, then drains whatever else is already queued."""
+    batch = [inbox.get()]
+    while batch[-1] is not None:
+        try:
+            batch.append(inbox.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def _run_worker(index, inbox, acks):
+    # Imported here: main imports this module to start the front
+    from main import build_application
+    from session_store import SessionStore, create_session_backend
+
+    session_store = SessionStore(create_session_backend())
+    application = build_application(
+        updater=False, metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else 0, session_store=session_store
+    )
+    tracker = _AckTracker(index, acks)
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    logger.info("Shard worker %d started", index)
+    try:
+        running = True
+        while running:
+            for item in await loop.run_in_executor(None, _next_batch, inbox):
+                if item is None:
+                    running = False
+                    break
+                update_id, key, data = item
+                tracker.begin(key, update_id)
+                task = asyncio.create_task(_process(application, session_store, tracker, key, update_id, data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        # Let in-flight turns finish so they are acknowledged rather than replayed
+        if tasks:
+            await asyncio.wait(tasks, timeout=SHARD_STOP_TIMEOUT)
+    finally:
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        logger.info("Shard worker %d stopped", index)
+
+
+def run_worker(index, inbox, acks):
+    """Entry point of worker process `index`: processes updates from `inbox` until it reads None."""
+    # Ctrl-C reaches the whole process group; the front decides when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, inbox, acks))
+
+
+# --- Front Side ---
+
+class ShardRouter:
+    """Starts the worker processes, routes updates to them and replays unacknowledged ones."""
+
+    def __init__(self, workers=SHARD_WORKERS):
+        self._context = multiprocessing.get_context("spawn")
+        self._ring = HashRing(range(workers))
+        self._acks = self._context.Queue()
+        self._processes = [None] * workers
+        self._inboxes = [None] * workers
+        # Per worker: update_id -> (shard key, update dict), until acknowledged
+        self._in_flight = [{} for _ in range(workers)]
+        self._loop = None
+        self._ack_thread = None
+        self._supervisor = None
+
+    def in_flight(self):
+        return sum(len(updates) for updates in self._in_flight)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for index in range(len(self._processes)):
+            self._spawn(index)
+        self._ack_thread = threading.Thread(target=self._read_acks, name="shard-acks", daemon=True)
+        self._ack_thread.start()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    def _spawn(self, index):
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=run_worker, args=(index, inbox, self._acks), name=f"shard-worker-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._inboxes[index] = inbox
+        in_flight = self._in_flight[index]
+        for update_id in sorted(in_flight):
+            inbox.put((update_id, *in_flight[update_id]))
+        if in_flight:
+            SHARD_REPLAYED.inc(len(in_flight))
+            logger.info("Replayed %d unacknowledged updates to shard worker %d", len(in_flight), index)
+
+    async def route(self, update: Update, context) -> None:
+        """TypeHandler callback: hands the update to the worker that owns its user."""
+        key = shard_key(update)
+        index = self._ring.node_for(key)
+        data = update.to_dict()
+        self._in_flight[index][update.update_id] = (key, data)
+        self._inboxes[index].put((update.update_id, key, data))
+        SHARD_ROUTED.inc(worker=str(index))
+
+    def _read_acks(self):
+        while True:
+            item = self._acks.get()
+            if item is None:
+                return
+            self._loop.call_soon_threadsafe(self._acknowledge, *item)
+
+    def _acknowledge(self, index, update_ids):
+        in_flight = self._in_flight[index]
+        for update_id in update_ids:
+            in_flight.pop(update_id, None)
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SHARD_SUPERVISE_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logger.warning("Shard worker %d exited with code %s, restarting it", index, process.exitcode)
+                    SHARD_RESTARTS.inc()
+                    self._spawn(index)
+
+    async def stop(self):
+        """Asks every worker to finish its in-flight updates and waits for them to exit."""
+        self._supervisor.cancel()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            await self._loop.run_in_executor(None, process.join, SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Shard worker %s did not stop in time, terminating it", process.name)
+                process.terminate()
+        self._acks.put(None)
+        if self.in_flight():
+            logger.warning("%d updates were not acknowledged before shutdown", self.in_flight())
+
+
+def build_front_application(workers: int = SHARD_WORKERS) -> Application:
+    """
+    Builds the front Application: it receives updates like the single-process bot does,
+    but its only handler routes them to the workers.
+    """
+    router = ShardRouter(workers)
+    Gauge("shard_in_flight_updates", "Updates routed but not yet acknowledged by a worker.",
+          function=router.in_flight)
+    metrics_server = lag_monitor = None
+
+    async def post_init(application: Application) -> None:
+        nonlocal metrics_server, lag_monitor
+        router.start()
+        if METRICS_PORT:
+            metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+            lag_monitor = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+
+    async def post_shutdown(application: Application) -> None:
+        await router.stop()
+        if metrics_server is not None:
+            lag_monitor.cancel()
+            metrics_server.close()
+
+    # Updates are routed one at a time, in order, so each user's updates reach their worker in order
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    if TELEGRAM_API_BASE_URL:
+        builder.base_url(TELEGRAM_API_BASE_URL)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, router.route))
+    return application
@@ -0,0 +1,31 @@
+import asyncio
+
+from telegram.error import BadRequest
+
+from config import STREAM_PLACEHOLDER
+from handlers import send_streamed_reply
+
+
+class FakeMessage:
+    """Records replies; edits of the messages it sends fail with `edit_error`."""
+
+    def __init__(self, edit_error=None):
+        self.edit_error = edit_error
+        self.sent = []
+
+    async def reply_text(self, text, **kwargs):
+        self.sent.append(text)
+        return FakeMessage(self.edit_error)
+
+    async def edit_text(self, text, **kwargs):
+        raise self.edit_error
+
+
+def test_reply_is_sent_as_a_new_message_when_the_final_edit_fails():
+    async def replies():
+        yield "Hello"
+        yield "Hello there"
+
+    message = FakeMessage(BadRequest("Message to edit not found"))
+    asyncio.run(send_streamed_reply(message, replies()))
+    assert message.sent == [STREAM_PLACEHOLDER, "Hello there"]
@@ -0,0 +1,36 @@
+import asyncio
+
+import metrics
+from metrics import start_metrics_server
+
+
+async def get(port, target):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response.decode().split("\r\n", 1)[0], response.decode().rpartition("\r\n\r\n")[2]
+
+
+def test_profile_start_rejects_bad_intervals():
+    async def scenario():
+        server = await start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            responses = [await get(port, f"/debug/profile/start?interval={value}") for value in ("0", "abc", "nan")]
+            running_after_bad = metrics.profiler.running
+            responses.append(await get(port, "/debug/profile/start?interval=0.01&x=1"))
+            running = metrics.profiler.running
+            responses.append(await get(port, "/debug/profile/stop"))
+        finally:
+            server.close()
+            await server.wait_closed()
+        return responses, running_after_bad, running
+
+    responses, running_after_bad, running = asyncio.run(scenario())
+    assert [status for status, _ in responses[:3]] == ["HTTP/1.1 400 Bad Request"] * 3
+    assert not running_after_bad
+    assert responses[3] == ("HTTP/1.1 200 OK", "profiling every 10 ms\n")
+    assert running
+    assert responses[4][0] == "HTTP/1.1 200 OK"
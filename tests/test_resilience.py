@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import ai_service
+import resilience
+from admission import LLMScheduler
+from ai_service import AIService
+from model_router import Route
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+def test_cancelled_half_open_trial_lets_the_next_call_through():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+        breaker.record_failure()
+        caller = ResilientCaller(max_attempts=1, breaker=breaker)
+
+        trial = asyncio.create_task(caller.call(lambda: asyncio.sleep(10), hedge=False))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        async def succeed():
+            return "ok"
+
+        return await caller.call(succeed, hedge=False), breaker.state
+
+    assert asyncio.run(scenario()) == ("ok", "closed")
+
+
+def test_running_half_open_trial_fails_other_calls_fast():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+        breaker.record_failure()
+        caller = ResilientCaller(max_attempts=1, breaker=breaker)
+        trial = asyncio.create_task(caller.call(lambda: asyncio.sleep(0.05), hedge=False))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            await caller.call(lambda: asyncio.sleep(0), hedge=False)
+        await trial
+
+    asyncio.run(scenario())
+
+
+def stalled_stream_client():
+    """A client whose streamed completions send one chunk and then stall."""
+    async def body():
+        chunk = {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                 "choices": [{"index": 0, "delta": {"content": "Hello"}, "finish_reason": None}]}
+        yield b"data: " + json.dumps(chunk).encode() + b"\n\n"
+        await asyncio.sleep(30)
+
+    async def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body())
+
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key="test", base_url="http://test.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_stalled_stream_is_bound_by_the_call_deadline(monkeypatch):
+    monkeypatch.setattr(ai_service, "client", stalled_stream_client())
+    monkeypatch.setattr(ai_service, "resilient_caller", ResilientCaller(deadline=0.3))
+
+    async def scenario():
+        service = AIService({})
+        route = Route("standard", "m", 100, 0.7, "persona")
+        received = []
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            async for delta in service._stream([{"role": "user", "content": "hi"}], route):
+                received.append(delta)
+        return received, loop.time() - start
+
+    received, elapsed = asyncio.run(scenario())
+    assert received == ["Hello"]
+    assert elapsed < 2
+
+
+def rate_limited_client(requests):
+    """A client whose completions are all rejected with a 429; `requests` counts what was sent."""
+    async def handler(request):
+        requests.append(request)
+        return httpx.Response(429, json={"error": {"message": "rate limited", "type": "rate_limit"}})
+
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key="test", base_url="http://test.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_every_retry_goes_through_admission(monkeypatch):
+    from openai import RateLimitError
+
+    requests = []
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0)
+    monkeypatch.setattr(ai_service, "client", rate_limited_client(requests))
+    monkeypatch.setattr(ai_service, "llm_scheduler", scheduler)
+    monkeypatch.setattr(ai_service, "resilient_caller", ResilientCaller(max_attempts=3))
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0)
+
+    async def scenario():
+        route = Route("standard", "m", 100, 0.7, "persona")
+        with pytest.raises(RateLimitError):
+            await AIService({})._complete([{"role": "user", "content": "hi"}], route)
+
+    asyncio.run(scenario())
+    assert scheduler.admitted == len(requests) == 3
+
+
+def test_hedge_waits_for_admission():
+    async def scenario():
+        caller = ResilientCaller(hedging=True, hedge_quantile=0.5, hedge_min_samples=1)
+        caller.latency.record(0.01)
+        admitted = []
+        attempts = iter([0.5, 0])
+
+        async def admit():
+            admitted.append(True)
+
+        async def attempt():
+            await asyncio.sleep(next(attempts))
+            return "done"
+
+        result = await caller.call(attempt, admit=admit)
+        return result, admitted, caller.hedge_wins
+
+    assert asyncio.run(scenario()) == ("done", [True], 1)
@@ -0,0 +1,71 @@
+import asyncio
+from collections import deque
+
+import ai_service
+from ai_service import AIService
+from config import USER_DATA_GOAL, USER_DATA_HISTORY, USER_DATA_NAME, USER_DATA_PERSONA
+from history import USER, PromptTurn, Turn
+from openers import GOAL_MARKER, NAME_MARKER, personalize
+from response_cache import ResponseCache, generalize, is_cacheable
+
+
+def test_goal_is_not_replaced_inside_other_words():
+    reply = "What is your favourite function? Let's have fun with it."
+    generalized = generalize(reply, "Alex", "fun")
+    assert generalized == f"What is your favourite function? Let's have {GOAL_MARKER} with it."
+    assert personalize(generalized, "Priya", "get a job as a PM") == (
+        "What is your favourite function? Let's have get a job as a PM with it."
+    )
+
+
+def test_name_and_goal_are_replaced_as_whole_phrases():
+    reply = "Alex, you want to pass my history exam. Alexander won't help, Alex."
+    generalized = generalize(reply, "Alex", "pass my history exam")
+    assert generalized == f"{NAME_MARKER}, you want to {GOAL_MARKER}. Alexander won't help, {NAME_MARKER}."
+    assert personalize(generalized, "Sofia", "get better at pitching") == (
+        "Sofia, you want to get better at pitching. Alexander won't help, Sofia."
+    )
+
+
+def test_short_names_and_goals_are_not_shared():
+    assert is_cacheable("Alex", "to pass my history exam")
+    assert is_cacheable("", "")
+    assert not is_cacheable("Al", "to pass my history exam")
+    assert not is_cacheable("Alex", "fun")
+
+
+def cached_services(monkeypatch):
+    """Two Investor conversations whose histories differ only in the user, sharing a fresh cache."""
+    monkeypatch.setattr(ai_service, "response_cache", ResponseCache(max_entries=10, db_path=""))
+    services = []
+    for name in ("Will", "Priya"):
+        service = AIService({USER_DATA_NAME: name, USER_DATA_GOAL: "to raise a seed round",
+                             USER_DATA_PERSONA: "Investor"})
+        history = service.user_data[USER_DATA_HISTORY] = [
+            PromptTurn("Investor", name, "to raise a seed round"), Turn(USER, "We sell meal kits."),
+        ]
+        services.append((service, history))
+    return services
+
+
+def test_reply_mentioning_a_common_word_name_is_not_shared(monkeypatch):
+    (will, will_history), (priya, priya_history) = cached_services(monkeypatch)
+    route = will._route("turn")
+    will._cache_reply(will_history, route, "Will your product scale?")
+    assert priya._cached_reply(priya_history, route) is None
+
+    will._cache_reply(will_history, route, "Does your product scale?")
+    assert priya._cached_reply(priya_history, route) == "Does your product scale?"
+
+
+def test_pooled_opener_is_cached_in_marker_form(monkeypatch):
+    (will, _), (priya, _) = cached_services(monkeypatch)
+    monkeypatch.setattr(ai_service.opener_pool, "pool_size", 1)
+    monkeypatch.setattr(ai_service.opener_pool, "refill", lambda persona_name: None)
+    ai_service.opener_pool._pools["Investor"] = deque([f"{NAME_MARKER}, will it scale?"])
+
+    async def scenario():
+        return (await will.set_persona("Investor", "Will", "to raise a seed round"),
+                await priya.set_persona("Investor", "Priya", "to raise a seed round"))
+
+    assert asyncio.run(scenario()) == ("Will, will it scale?", "Priya, will it scale?")
@@ -0,0 +1,146 @@
+import asyncio
+import pickle
+import threading
+
+from config import USER_DATA_NAME, USER_DATA_PERSONA
+from session_store import MemorySessionBackend, SessionStore
+
+
+class FlakyBackend(MemorySessionBackend):
+    """Fails the first `failures` writes."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def save_many(self, sessions):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().save_many(sessions)
+
+
+class SlowBackend(MemorySessionBackend):
+    """Holds every write until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+        self.events = []
+
+    def save_many(self, sessions):
+        self.writing.set()
+        self.release.wait(5)
+        super().save_many(sessions)
+        self.events.append(("saved", len(sessions)))
+
+    def close(self):
+        self.events.append("closed")
+
+
+def stored(backend, user_id):
+    data = backend.load(user_id)
+    return pickle.loads(data) if data is not None else None
+
+
+def test_persist_waits_for_the_flush_that_writes_the_session():
+    async def scenario():
+        backend = MemorySessionBackend()
+        store = SessionStore(backend, flush_interval=0.05)
+        store.start()
+        store.get(1)[USER_DATA_NAME] = "Alex"
+        before = stored(backend, 1)
+        await store.persist(1)
+        after = stored(backend, 1)
+        await store.stop()
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before is None
+    assert after == {USER_DATA_NAME: "Alex"}
+
+
+def test_persist_covers_changes_made_through_a_held_reference():
+    async def scenario():
+        backend = MemorySessionBackend()
+        store = SessionStore(backend, flush_interval=0.02)
+        store.start()
+        session = store.get(1)
+        await asyncio.sleep(0.05)  # a flush writes the session while a turn still holds it
+        session[USER_DATA_NAME] = "Priya"
+        await store.persist(1)
+        result = stored(backend, 1)
+        await store.stop()
+        return result
+
+    assert asyncio.run(scenario()) == {USER_DATA_NAME: "Priya"}
+
+
+def test_persist_retries_after_a_failed_flush():
+    async def scenario():
+        backend = FlakyBackend(failures=2)
+        store = SessionStore(backend, flush_interval=0.02)
+        store.start()
+        store.get(1)[USER_DATA_NAME] = "Jordan"
+        await asyncio.wait_for(store.persist(1), 1)
+        result = stored(backend, 1)
+        await store.stop()
+        return result, backend.failures
+
+    assert asyncio.run(scenario()) == ({USER_DATA_NAME: "Jordan"}, 0)
+
+
+def test_persist_without_a_flusher_writes_immediately():
+    async def scenario():
+        backend = MemorySessionBackend()
+        store = SessionStore(backend)
+        store.get(1)[USER_DATA_NAME] = "Mateo"
+        await store.persist(1)
+        return stored(backend, 1)
+
+    assert asyncio.run(scenario()) == {USER_DATA_NAME: "Mateo"}
+
+
+def test_session_reloaded_while_its_flush_is_written_is_the_same_dict():
+    async def scenario():
+        backend = SlowBackend()
+        store = SessionStore(backend, cache_size=1, flush_interval=0.01)
+        store.start()
+        session = store.get(1)
+        session[USER_DATA_PERSONA] = "Investor"
+        await asyncio.to_thread(backend.writing.wait)
+        store.get(2)  # evicts user 1 while its batch is still being written
+        reloaded = store.get(1)
+        backend.release.set()
+        await store.persist(1)
+        await store.stop()
+        return session, reloaded, stored(backend, 1)
+
+    session, reloaded, result = asyncio.run(scenario())
+    assert reloaded is session
+    assert result == {USER_DATA_PERSONA: "Investor"}
+
+
+def test_stop_waits_for_the_batch_being_written():
+    async def scenario():
+        backend = SlowBackend()
+        store = SessionStore(backend, flush_interval=0.01)
+        store.start()
+        for user_id in range(100):
+            store.get(user_id)[USER_DATA_NAME] = f"user {user_id}"
+        await asyncio.to_thread(backend.writing.wait)
+        store.get(100)[USER_DATA_NAME] = "late"  # queued behind the batch being written
+        stopping = asyncio.create_task(store.stop())
+        await asyncio.sleep(0.05)
+        still_running = not stopping.done()
+        backend.release.set()
+        await stopping
+        return still_running, backend
+
+    still_running, backend = asyncio.run(scenario())
+    assert still_running
+    assert backend.events == [("saved", 100), ("saved", 1), "closed"]
+    assert stored(backend, 0) == {USER_DATA_NAME: "user 0"}
+    assert stored(backend, 100) == {USER_DATA_NAME: "late"}
@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import pickle
+import queue
+
+from telegram import Chat, Message, Update, User
+
+from config import USER_DATA_NAME
+from session_store import MemorySessionBackend, SessionStore
+from sharding import HashRing, _AckTracker, _process, shard_key
+
+
+def message_update(update_id, chat_id, user_id, text="hi"):
+    chat = Chat(chat_id, Chat.PRIVATE if chat_id == user_id else Chat.GROUP)
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), chat,
+                      from_user=User(user_id, "User", False), text=text)
+    return Update(update_id, message=message)
+
+
+def test_a_users_updates_from_different_chats_go_to_one_worker():
+    ring = HashRing(range(8))
+    user_id = 1234
+    keys = {shard_key(message_update(i, chat_id, user_id)) for i, chat_id in enumerate((user_id, -100, -200, -300))}
+    assert keys == {user_id}
+    assert len({ring.node_for(key) for key in keys}) == 1
+
+
+def test_hash_ring_spreads_users_and_is_stable():
+    ring = HashRing(range(4))
+    nodes = [ring.node_for(user_id) for user_id in range(4000)]
+    assert nodes == [HashRing(range(4)).node_for(user_id) for user_id in range(4000)]
+    assert all(600 < nodes.count(node) < 1400 for node in range(4))
+
+
+class FakeProcessor:
+    async def process_update(self, update, coroutine):
+        await coroutine
+
+
+class FakeApplication:
+    """Runs a handler that writes the update's text into the user's session."""
+
+    bot = None
+    update_processor = FakeProcessor()
+
+    def __init__(self, store):
+        self.store = store
+
+    async def process_update(self, update):
+        self.store.get(update.effective_user.id)[USER_DATA_NAME] = update.message.text
+
+
+def test_update_is_acknowledged_only_after_its_session_is_written():
+    async def scenario():
+        backend = MemorySessionBackend()
+        store = SessionStore(backend, flush_interval=0.1)
+        store.start()
+        acks = queue.Queue()
+        tracker = _AckTracker(0, acks)
+        update = message_update(1, 42, 42, text="Alex")
+        tracker.begin(42, 1)
+        task = asyncio.create_task(_process(FakeApplication(store), store, tracker, 42, 1, update.to_dict()))
+        await asyncio.sleep(0.02)
+        # The handler is done, but the session is only in memory: no ack yet
+        acked_early = not acks.empty()
+        await task
+        saved = pickle.loads(backend.load(42))
+        await store.stop()
+        return acked_early, acks.get_nowait(), saved
+
+    acked_early, ack, saved = asyncio.run(scenario())
+    assert not acked_early
+    assert ack == (0, [1])
+    assert saved == {USER_DATA_NAME: "Alex"}
@@ -0,0 +1,156 @@
+import asyncio
+
+from turn_scheduler import TurnScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Recorder:
+    """A `process` callable that records its batches and checks no two turns of a key overlap."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.batches = []
+        self.running = set()
+        self.overlaps = 0
+
+    def for_key(self, key):
+        async def process(batch):
+            if key in self.running:
+                self.overlaps += 1
+            self.running.add(key)
+            try:
+                await asyncio.sleep(self.delay)
+                self.batches.append((key, list(batch)))
+            finally:
+                self.running.discard(key)
+        return process
+
+
+def test_messages_are_processed_in_order_exactly_once():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0.005)
+        recorder = Recorder()
+        tasks = []
+        for i in range(30):
+            tasks.append(asyncio.create_task(scheduler.submit("chat", i, recorder.for_key("chat"))))
+            await asyncio.sleep(0.002)
+        await asyncio.gather(*tasks)
+        return recorder
+
+    recorder = run(scenario())
+    processed = [message for _, batch in recorder.batches for message in batch]
+    assert processed == list(range(30))
+
+
+def test_turns_of_one_key_never_overlap():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0)
+        recorder = Recorder(delay=0.005)
+        tasks = [
+            asyncio.create_task(scheduler.submit(key, i, recorder.for_key(key)))
+            for i in range(20) for key in ("a", "b")
+        ]
+        await asyncio.gather(*tasks)
+        return recorder
+
+    recorder = run(scenario())
+    assert recorder.overlaps == 0
+    for key in ("a", "b"):
+        assert [m for k, batch in recorder.batches if k == key for m in batch] == list(range(20))
+
+
+def test_burst_is_answered_with_one_turn():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0.05)
+        recorder = Recorder()
+        results = await asyncio.gather(*(scheduler.submit("chat", i, recorder.for_key("chat")) for i in range(5)))
+        return scheduler, recorder, results
+
+    scheduler, recorder, results = run(scenario())
+    assert results == [True, False, False, False, False]
+    assert recorder.batches == [("chat", [0, 1, 2, 3, 4])]
+    assert scheduler.turns == 1
+    assert scheduler.calls_saved == 4
+
+
+def test_messages_during_a_running_turn_form_the_next_turn():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0)
+        recorder = Recorder(delay=0.05)
+        first = asyncio.create_task(scheduler.submit("chat", 0, recorder.for_key("chat")))
+        await asyncio.sleep(0.01)
+        rest = [asyncio.create_task(scheduler.submit("chat", i, recorder.for_key("chat"))) for i in (1, 2, 3)]
+        await asyncio.gather(first, *rest)
+        return scheduler, recorder
+
+    scheduler, recorder = run(scenario())
+    assert recorder.batches == [("chat", [0]), ("chat", [1, 2, 3])]
+    assert scheduler.calls_saved == 2
+
+
+def test_exclusive_waits_for_the_running_turn():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0)
+        events = []
+
+        async def process(batch):
+            events.append("turn start")
+            await asyncio.sleep(0.05)
+            events.append("turn end")
+
+        turn = asyncio.create_task(scheduler.submit("chat", "hi", process))
+        await asyncio.sleep(0.01)
+        async with scheduler.exclusive("chat"):
+            events.append("exclusive")
+        await turn
+        return events
+
+    assert run(scenario()) == ["turn start", "turn end", "exclusive"]
+
+
+def test_pending_turn_waits_for_exclusive_block():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0)
+        events = []
+
+        async def process(batch):
+            events.append(("turn", batch))
+
+        async with scheduler.exclusive("chat"):
+            turn = asyncio.create_task(scheduler.submit("chat", "hi", process))
+            await asyncio.sleep(0.01)
+            events.append("exclusive")
+        await turn
+        return scheduler, events
+
+    scheduler, events = run(scenario())
+    assert events == ["exclusive", ("turn", ["hi"])]
+    assert scheduler._chats == {}
+
+
+def test_cancelled_leader_drops_its_batch_and_frees_the_key():
+    async def scenario():
+        scheduler = TurnScheduler(debounce=0.05)
+        recorder = Recorder()
+        leader = asyncio.create_task(scheduler.submit("chat", 0, recorder.for_key("chat")))
+        await asyncio.sleep(0.01)
+        merged = await scheduler.submit("chat", 1, recorder.for_key("chat"))
+        leader.cancel()
+        try:
+            await leader
+        except asyncio.CancelledError:
+            pass
+        state_after_cancel = dict(scheduler._chats)
+        ran = await scheduler.submit("chat", 2, recorder.for_key("chat"))
+        return merged, state_after_cancel, ran, recorder, scheduler
+
+    merged, state_after_cancel, ran, recorder, scheduler = run(scenario())
+    assert merged is False
+    assert state_after_cancel == {}
+    # The next message starts a fresh turn instead of queueing behind the cancelled leader
+    assert ran is True
+    assert recorder.batches == [("chat", [2])]
+    assert scheduler._chats == {}
@@ -0,0 +1,98 @@
+"""
+Per-chat turn serialization with burst coalescing.
+
+Only one model turn runs per conversation at a time, so concurrent updates can't
+interleave appends to the same history. Messages that arrive within the debounce
+window, or while the previous turn is still running, are merged into the next
+turn and answered with a single model call.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from config import TURN_DEBOUNCE_SECONDS
+
+
+class _ChatTurns:
+    """Scheduling state for one conversation."""
+
+    __slots__ = ("lock", "pending", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = []
+        self.users = 0
+
+
+class TurnScheduler:
+    """
+    Serializes turns per conversation key and coalesces bursts of messages.
+
+    The first message of a burst becomes the turn's leader: it waits for the debounce
+    window and for any running turn to finish, then processes every message queued by
+    then as one batch. Batches are processed in arrival order.
+    """
+
+    def __init__(self, debounce=TURN_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._chats = {}
+        self.messages = 0
+        self.turns = 0
+
+    @property
+    def calls_saved(self):
+        """Number of messages that were answered as part of another message's turn."""
+        return self.messages - self.turns
+
+    def _acquire_state(self, key):
+        state = self._chats.get(key)
+        if state is None:
+            state = self._chats[key] = _ChatTurns()
+        state.users += 1
+        return state
+
+    def _release_state(self, key, state):
+        state.users -= 1
+        if state.users == 0 and not state.pending and self._chats.get(key) is state:
+            del self._chats[key]
+
+    async def submit(self, key, message, process):
+        """
+        Queues `message` for the conversation identified by `key`.
+
+        `process` is an async callable receiving the list of messages of a turn. Returns
+        True if this call ran the turn, or False if the message was merged into a turn
+        run by an earlier call.
+        """
+        state = self._chats.get(key)
+        if state is not None and state.pending:
+            state.pending.append(message)
+            self.messages += 1
+            return False
+
+        state = self._acquire_state(key)
+        state.pending.append(message)
+        self.messages += 1
+        drained = False
+        try:
+            if self.debounce > 0:
+                await asyncio.sleep(self.debounce)
+            async with state.lock:
+                batch, state.pending = state.pending, []
+                drained = True
+                self.turns += 1
+                await process(batch)
+        finally:
+            if not drained:
+                # Cancelled before the turn ran; don't leave followers waiting on a leader that's gone.
+                state.pending.clear()
+            self._release_state(key, state)
+        return True
+
+    @asynccontextmanager
+    async def exclusive(self, key):
+        """Runs the enclosed block as a turn of its own, e.g. to start or end a simulation."""
+        state = self._acquire_state(key)
+        try:
+            async with state.lock:
+                yield
+        finally:
+            self._release_state(key, state)